@@ -1,236 +1,2207 @@
 #!/usr/bin/env python3
 import os
+import re
+import sys
 import json
 import shutil
+import tempfile
+import hashlib
+import fnmatch
+import time
+import math
+import heapq
+import random
+import contextlib
+import sqlite3
 import collections
+import multiprocessing
+import threading
+import concurrent.futures
+import zipfile
+import signal
+import select
+import struct
+import ctypes
+import ctypes.util
+import socketserver
+import http.server
+import http.client
+import urllib.parse
+import urllib.request
+import urllib.error
 import argostranslate.package
+import argostranslate.settings
 import argostranslate.translate
 
 # ---------- Utils ----------
-def log(msg):
-    print(f"[TRANSLATOR] {msg}", flush=True)
+# A message is printed when its level is <= LOG_LEVEL: QUIET messages (errors,
+# final reports) always, DEBUG ones (per-key details) only with LOG_LEVEL=debug.
+QUIET, INFO, DEBUG = 0, 1, 2
+
+# log lines and metrics may come from download threads
+output_lock = threading.RLock()
+
+def log(msg, level=INFO):
+    if level <= LOG_LEVEL:
+        with output_lock:
+            # debug lines can be numerous: let stdout buffer them
+            print(f"[TRANSLATOR] {msg}", flush=level < DEBUG)
+
+# ---------- Metrics: timed spans emitted as JSON lines ----------
+# Every phase of the run is wrapped in span(name, **fields); the block can add
+# counts to the yielded record. Finished spans are printed as one JSON object
+# per line (and appended to METRICS_FILE when set) and summarized at the end.
+# Nested spans are named "<parent>.<child>" so stage totals don't double count.
+stage_times = {}
+span_totals = {}
+metrics_out = None
+
+def emit_metric(record):
+    global metrics_out
+    line = json.dumps(record, ensure_ascii=False)
+    with output_lock:
+        if LOG_LEVEL >= INFO:
+            print(line, flush=True)
+        if METRICS_FILE:
+            if metrics_out is None:
+                safe_makedirs(os.path.dirname(METRICS_FILE) or ".")
+                metrics_out = open(METRICS_FILE, "a", encoding="utf-8")
+            metrics_out.write(line + "\n")
+            metrics_out.flush()
+
+@contextlib.contextmanager
+def span(name, **fields):
+    record = {"span": name, **fields}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        secs = time.perf_counter() - start
+        record["ms"] = round(secs * 1000, 3)
+        # spans may end at the same time in download threads
+        with output_lock:
+            stage_times[name] = stage_times.get(name, 0.0) + secs
+            totals = span_totals.setdefault(name, {"count": 0})
+            totals["count"] += 1
+            for k, v in record.items():
+                if k not in ("span", "ms") and isinstance(v, (int, float)) and not isinstance(v, bool):
+                    totals[k] = totals.get(k, 0) + v
+        emit_metric(record)
+
+def emit_metrics_summary():
+    summary = {name: {**totals, "ms": round(stage_times[name] * 1000, 3)} for name, totals in span_totals.items()}
+    log("Timings: " + ", ".join(f"{name} {secs * 1000:.1f} ms" for name, secs in stage_times.items() if "." not in name),
+        QUIET)
+    emit_metric({"summary": summary})
+    if metrics_out is not None:
+        metrics_out.close()
 
 def safe_makedirs(path):
     try:
         os.makedirs(path, exist_ok=True)
     except Exception as e:
-        log(f"Could not create directory {path}: {e}")
+        log(f"Could not create directory {path}: {e}", QUIET)
 
 # ---------- Config from env ----------
 SRC = os.environ.get("SOURCE_LANG", "fr")
-DST = os.environ.get("TARGET_LANG", "en")
+# quiet (errors and final summaries), info (default, per-file progress) or debug (every key)
+LOG_LEVEL = {"quiet": QUIET, "info": INFO, "debug": DEBUG}.get(os.environ.get("LOG_LEVEL", "info").lower(), INFO)
+# Translation progress (with rate and ETA) is logged every PROGRESS_EVERY strings
+PROGRESS_EVERY = max(1, int(os.environ.get("PROGRESS_EVERY", "1000")))
+# One or more target languages, comma separated (e.g. "en" or "es,de,it")
+TARGETS = list(dict.fromkeys(t.strip() for t in os.environ.get("TARGET_LANG", "en").split(",") if t.strip()))
 INPUT_DIR = os.environ.get("INPUT_DIR", "/app/input")
+# Input files are searched recursively; INCLUDE / EXCLUDE are comma separated globs
+# matched against the path relative to INPUT_DIR ("*" also crosses "/", "**/" may match nothing)
+INCLUDE = [p.strip() for p in os.environ.get("INCLUDE", "*.arb").split(",") if p.strip()]
+EXCLUDE = [p.strip() for p in os.environ.get("EXCLUDE", "").split(",") if p.strip()]
 TMP_OUTPUT = os.environ.get("TMP_OUTPUT", "/tmp/output")
 FINAL_OUTPUT = os.environ.get("OUTPUT_DIR", "/app/output")
+# ICU MessageFormat values ({name}, {count, plural, ...}) only send their text to
+# the model, placeholders and plural/select syntax are kept as they are (0 to disable)
+ICU_MESSAGES = os.environ.get("ICU_MESSAGES", "1") != "0"
 # Optional: prioritized pivot list, comma separated (e.g. "en,fr,de")
 PIVOT_ORDER_ENV = os.environ.get("PIVOT_ORDER", "")
 PIVOT_PREFERRED = [p.strip() for p in PIVOT_ORDER_ENV.split(",") if p.strip()]
+# Route planning: every hop costs 1, plus ROUTE_LATENCY_WEIGHT per measured ms/char of
+# the model and ROUTE_INSTALL_COST when it still has to be downloaded; pivots listed in
+# PIVOT_ORDER (default: en, fr, de, es) get a bias below ROUTE_PIVOT_BIAS
+ROUTE_LATENCY_WEIGHT = float(os.environ.get("ROUTE_LATENCY_WEIGHT", "1.0"))
+ROUTE_INSTALL_COST = float(os.environ.get("ROUTE_INSTALL_COST", "0.4"))
+ROUTE_PIVOT_BIAS = float(os.environ.get("ROUTE_PIVOT_BIAS", "0.1"))
+# Routing table and measured hop latencies are kept here (empty string = not persisted)
+ROUTES_PATH = os.environ.get("ROUTES_PATH", "/app/cache/routes.json")
+# Max number of strings sent to the decoder in one batched call
+BATCH_SIZE = max(1, int(os.environ.get("BATCH_SIZE", "32")))
+# Memory budget (MB) of the models loaded at the same time, per process (shared between
+# WORKERS); least recently used models are unloaded to make room (0 = no limit)
+MODEL_MEMORY_MB = max(0.0, float(os.environ.get("MODEL_MEMORY_MB", "0")))
+# Token budget of a batch once padded to its longest string (0 = BATCH_SIZE only);
+# strings are sorted by length first so short labels are not padded to long texts
+BATCH_TOKENS = max(0, int(os.environ.get("BATCH_TOKENS", "2048")))
+# On-disk translation memory (SQLite); set to an empty string to disable
+TM_PATH = os.environ.get("TM_PATH", "/app/cache/translations.sqlite")
+# Translation worker processes: 1 = sequential (default), 0 or "auto" = one per CPU core
+WORKERS_ENV = os.environ.get("WORKERS", "1").strip().lower()
+WORKERS = (os.cpu_count() or 1) if WORKERS_ENV in ("0", "auto") else max(1, int(WORKERS_ENV))
+# Files with more pending strings than this are split into several work units
+CHUNK_KEYS = max(1, int(os.environ.get("CHUNK_KEYS", "2000")))
+# "translate" (default): translate INPUT_DIR once; "serve": keep models loaded and
+# answer translation requests over HTTP (SERVE_HOST/SERVE_PORT or a SERVE_SOCKET UNIX socket);
+# "bench": translate a generated synthetic corpus and report per-stage timings
+# Command line: main.py [mode] [--inter-threads N] [--intra-threads N] [--compute-type T]
+# (options also as --name=value; only read when run as a script: importing main.py,
+# e.g. from the tests, ignores sys.argv)
+MODES = ("translate", "serve", "bench", "autotune", "merge")
+CLI_OPTION_NAMES = ("inter-threads", "intra-threads", "compute-type")
+CLI_USAGE = f"usage: main.py [{'|'.join(MODES)}] [--inter-threads N] [--intra-threads N] [--compute-type T]"
+
+def cli_error(msg):
+    print(f"{msg}\n{CLI_USAGE}", file=sys.stderr)
+    raise SystemExit(2)
+
+def parse_cli(argv):
+    """(positional arguments, {option: value}) of the command line."""
+    args, options = [], {}
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if not arg.startswith("--"):
+            args.append(arg)
+            continue
+        name, eq, value = arg[2:].partition("=")
+        if name not in CLI_OPTION_NAMES:
+            cli_error(f"Unknown option --{name}")
+        if not eq:
+            if not argv or argv[0].startswith("--"):
+                cli_error(f"Option --{name} needs a value")
+            value = argv.pop(0)
+        options[name] = value
+    return args, options
+
+def cli_count(name, env):
+    # thread counts: non-negative integers, 0 = not set
+    value = CLI_OPTIONS.get(name) or os.environ.get(env, "0")
+    try:
+        count = int(value)
+    except ValueError:
+        count = -1
+    if count < 0:
+        cli_error(f"--{name} / {env} must be a non-negative integer, got {value!r}")
+    return count
+
+CLI_ARGS, CLI_OPTIONS = parse_cli(sys.argv[1:] if __name__ == "__main__" else [])
+if len(CLI_ARGS) > 1:
+    cli_error(f"Unexpected argument(s): {' '.join(CLI_ARGS[1:])}")
+MODE = CLI_ARGS[0] if CLI_ARGS else os.environ.get("MODE", "translate")
+SERVE_HOST = os.environ.get("SERVE_HOST", "127.0.0.1")
+SERVE_PORT = int(os.environ.get("SERVE_PORT", "8765"))
+SERVE_SOCKET = os.environ.get("SERVE_SOCKET", "")
+if MODE not in MODES:
+    cli_error(f"Unknown mode '{MODE}' (expected {', '.join(repr(m) for m in MODES)})")
+# CTranslate2 settings of the loaded models (0 / empty = tuned value for the pair, else argos' default);
+# "autotune" benchmarks combinations on a sample of INPUT_DIR and stores the fastest in TUNING_PATH
+CT2_INTER_THREADS = cli_count("inter-threads", "CT2_INTER_THREADS")
+CT2_INTRA_THREADS = cli_count("intra-threads", "CT2_INTRA_THREADS")
+CT2_COMPUTE_TYPE = CLI_OPTIONS.get("compute-type") or os.environ.get("CT2_COMPUTE_TYPE", "")
+TUNING_PATH = os.environ.get("TUNING_PATH", "/app/cache/ct2_tuning.json")
+AUTOTUNE_SAMPLE = max(1, int(os.environ.get("AUTOTUNE_SAMPLE", "200")))
+AUTOTUNE_COMPUTE_TYPES = [t.strip() for t in os.environ.get("AUTOTUNE_COMPUTE_TYPES", "int8,float32").split(",")
+                          if t.strip()]
+# WATCH=1 (translate mode): after the first pass, keep the models loaded and re-translate
+# input files as they change; a burst of saves is handled once WATCH_DEBOUNCE_MS after the last
+WATCH = MODE == "translate" and os.environ.get("WATCH", "0") == "1"
+WATCH_DEBOUNCE_MS = max(0, int(os.environ.get("WATCH_DEBOUNCE_MS", "300")))
+WATCH_POLL = max(0.05, float(os.environ.get("WATCH_POLL", "0.5")))   # seconds, without inotify
+if MODE == "serve" or WATCH:
+    # models stay loaded in this process; forked workers would have to reload them
+    WORKERS = 1
+# Files at least this big (in MB) are streamed: read, translated and written in
+# STREAM_CHUNK-key chunks so memory stays flat (0 = stream every file)
+STREAM_THRESHOLD_MB = float(os.environ.get("STREAM_THRESHOLD_MB", "64"))
+STREAM_CHUNK = max(1, int(os.environ.get("STREAM_CHUNK", "2000")))
+# Optional file receiving the JSON-lines metrics of the run (appended)
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+# Incremental mode: only translate keys whose source changed since the last run (0 to disable)
+INCREMENTAL = os.environ.get("INCREMENTAL", "1") != "0"
+# Sharding: with SHARD_COUNT > 1 this node only translates the work units (file x target x
+# SHARD_KEYS keys) whose stable hash falls on SHARD_INDEX and writes partial outputs to
+# OUTPUT_DIR/.shards; "merge" then assembles the complete files from SHARD_DIR
+SHARD_COUNT = max(1, int(os.environ.get("SHARD_COUNT", "1")))
+SHARD_INDEX = int(os.environ.get("SHARD_INDEX", "0"))
+SHARD_KEYS = max(1, int(os.environ.get("SHARD_KEYS", "2000")))
+SHARD_DIR = os.environ.get("SHARD_DIR", os.path.join(FINAL_OUTPUT, ".shards"))
+SHARDED = SHARD_COUNT > 1 and MODE == "translate"
+if not 0 <= SHARD_INDEX < SHARD_COUNT:
+    print(f"SHARD_INDEX must be between 0 and {SHARD_COUNT - 1}", file=sys.stderr)
+    raise SystemExit(2)
+if SHARDED:
+    # outputs are partial: nothing to reuse from, and no file is streamed
+    INCREMENTAL = False
+# Cached package index is reused for this many seconds before being refreshed
+INDEX_TTL = int(os.environ.get("INDEX_TTL", "86400"))
+# Missing models are downloaded this many at a time (each retried DOWNLOAD_RETRIES
+# times, resuming where it stopped); MODEL_BASE_URL replaces the host part of the package links (e.g. a local HTTP server holding .argosmodel files)
+DOWNLOAD_WORKERS = max(1, int(os.environ.get("DOWNLOAD_WORKERS", "4")))
+DOWNLOAD_RETRIES = max(1, int(os.environ.get("DOWNLOAD_RETRIES", "3")))
+MODEL_BASE_URL = os.environ.get("MODEL_BASE_URL", "").rstrip("/")
+# Optional directory of .argosmodel files (with an index.json) installed from before the network
+MODEL_MIRROR_DIR = os.environ.get("MODEL_MIRROR_DIR", "")
+# OFFLINE=1: never touch the network, plan from the cached index and installed packages
+OFFLINE = os.environ.get("OFFLINE", "0") == "1"
+if MODE == "bench":
+    # the benchmark works in its own directory and always goes through the model
+    BENCH_DIR = os.environ.get("BENCH_DIR", "/tmp/translater-bench")
+    INPUT_DIR = os.path.join(BENCH_DIR, "input")
+    TMP_OUTPUT = os.path.join(BENCH_DIR, "tmp")
+    FINAL_OUTPUT = os.path.join(BENCH_DIR, "output")
+    TM_PATH = ""
+    INCREMENTAL = False
+    BENCH_FILES = int(os.environ.get("BENCH_FILES", "4"))
+    BENCH_KEYS = int(os.environ.get("BENCH_KEYS", "500"))            # keys per file
+    BENCH_WORDS = float(os.environ.get("BENCH_WORDS", "4"))          # mean words per value
+    BENCH_DUP_RATIO = float(os.environ.get("BENCH_DUP_RATIO", "0.3"))
+    BENCH_PLACEHOLDERS = float(os.environ.get("BENCH_PLACEHOLDERS", "0.1"))
+    BENCH_SEED = int(os.environ.get("BENCH_SEED", "1"))
+    BENCH_REPORT = os.environ.get("BENCH_REPORT", "")                 # optional JSON report path
+
+# ---------- Load available packages (cached remote index) ----------
+# argos keeps the downloaded index on disk; it is only refreshed when it is older
+# than INDEX_TTL and a model actually needs to be installed.
+def index_age():
+    try:
+        return time.time() - os.path.getmtime(argostranslate.settings.local_package_index)
+    except (OSError, AttributeError):
+        return None
+
+def load_available_packages():
+    # reads the cached index only, never downloads it
+    if index_age() is None:
+        return []
+    try:
+        return argostranslate.package.get_available_packages()
+    except Exception as e:
+        log(f"Could not read cached package index: {e}", QUIET)
+        return []
+
+# installed packages indexed by (from_code, to_code), built once from package
+# metadata and kept up to date by install_pair
+installed_index = {}
+available = []
+index_fresh = False
+
+def load_index():
+    global available, index_fresh
+    with span("index") as sp:
+        installed_index.update(((p.from_code, p.to_code), p) for p in argostranslate.package.get_installed_packages())
+        available = load_available_packages()
+        sp.update(available=len(available), installed=len(installed_index))
+    age = index_age()
+    index_fresh = age is not None and age <= INDEX_TTL
+    if age is None:
+        log("No cached package index")
+    else:
+        log(f"Cached package index: {len(available)} packages, {int(age)}s old (TTL {INDEX_TTL}s)")
+    if OFFLINE:
+        log("Offline mode: using cached index and installed packages only")
+
+# ---------- Local model mirror (MODEL_MIRROR_DIR) ----------
+# A directory of .argosmodel files described by an index.json in the argos index
+# format: from_code, to_code, package_version, a "filename" (or the original
+# "links", matched by file name) and optionally a "sha256". Without index.json
+# the metadata.json of each archive is read. Pairs found there are planned and
+# installed from disk, without refreshing the remote index or downloading.
+def mirror_entry_from_archive(name):
+    try:
+        with zipfile.ZipFile(os.path.join(MODEL_MIRROR_DIR, name)) as z:
+            meta = next(n for n in z.namelist() if n.count("/") == 1 and n.endswith("/metadata.json"))
+            return {**json.loads(z.read(meta)), "filename": name}
+    except (OSError, ValueError, StopIteration, zipfile.BadZipFile) as e:
+        log(f"Skipping mirror archive {name}: {e or 'no metadata.json'}", QUIET)
+        return None
 
-# ---------- Prepare folders ----------
-safe_makedirs(TMP_OUTPUT)
-safe_makedirs(FINAL_OUTPUT)
+def load_mirror():
+    if not MODEL_MIRROR_DIR:
+        return {}
+    index_path = os.path.join(MODEL_MIRROR_DIR, "index.json")
+    try:
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        else:
+            entries = [mirror_entry_from_archive(name) for name in sorted(os.listdir(MODEL_MIRROR_DIR))
+                       if name.endswith(".argosmodel")]
+    except (OSError, ValueError) as e:
+        log(f"Could not read model mirror {MODEL_MIRROR_DIR}: {e}", QUIET)
+        return {}
+    mirror = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("from_code") or not entry.get("to_code"):
+            continue
+        links = [os.path.basename(urllib.parse.urlparse(link).path) for link in entry.get("links") or []]
+        name = entry.get("filename") or next(iter(links), None)
+        path = os.path.join(MODEL_MIRROR_DIR, name) if name else None
+        if path and os.path.isfile(path):
+            mirror[(entry["from_code"], entry["to_code"])] = {**entry, "path": path}
+    return mirror
 
-log("---- START ----")
-log(f"Requested: {SRC} -> {DST}")
-if PIVOT_PREFERRED:
-    log(f"Preferred pivot order: {PIVOT_PREFERRED}")
+mirror_index = {}
 
-# ---------- Load available packages (remote index) ----------
-log("Updating package index...")
-argostranslate.package.update_package_index()
-available = argostranslate.package.get_available_packages()
-log(f"Available packages count: {len(available)}")
+def load_mirror_index():
+    with span("mirror") as sp:
+        mirror_index.update(load_mirror())
+        sp["packages"] = len(mirror_index)
+    if MODEL_MIRROR_DIR:
+        log(f"Model mirror: {len(mirror_index)} packages in {MODEL_MIRROR_DIR}")
 
 # ---------- Build directed graph of available translations ----------
-# nodes are language codes; edges exist if a package from->to available
+# nodes are language codes; edges exist if a package from->to is available (unless OFFLINE), installed or mirrored
 graph = {}
-for p in available:
-    graph.setdefault(p.from_code, set()).add(p.to_code)
+
+def build_graph():
+    with span("graph") as sp:
+        graph.clear()
+        # offline, a package that is only in the index cannot be downloaded: no edge
+        remote = [] if OFFLINE else [(p.from_code, p.to_code) for p in available]
+        edges = remote + sorted(installed_index) + sorted(mirror_index)
+        for from_code, to_code in edges:
+            graph.setdefault(from_code, set()).add(to_code)
+        sp.update(languages=len(graph), edges=len(set(edges)))
 
 def neighbors(lang):
     return graph.get(lang, set())
 
-# ---------- Helper: find path using BFS, but favor preferred pivots ----------
-def find_path(src, dst, preferred_pivots=None):
-    """
-    Find shortest path from src to dst using available directed edges.
-    If preferred_pivots is provided, tries paths that include those pivots earlier.
-    Returns list of nodes [src, ..., dst] or None.
-    """
+# ---------- Routing table: weighted shortest routes for every language pair ----------
+# Dijkstra is run from every language once per version of the index (available and
+# installed packages, pivot preferences, cost weights, measured hop latencies) and
+# the result is persisted in ROUTES_PATH, so planning a route is a dictionary lookup.
+COMMON_PIVOTS = ["en", "fr", "de", "es"]
+pivot_order = PIVOT_PREFERRED or COMMON_PIVOTS
+routing_table = {}
+
+def load_route_cache():
+    if not ROUTES_PATH:
+        return {}
+    try:
+        with open(ROUTES_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_route_cache():
+    if not ROUTES_PATH:
+        return
+    safe_makedirs(os.path.dirname(ROUTES_PATH) or ".")
+    tmp = ROUTES_PATH + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(route_cache, f, ensure_ascii=False)
+        os.replace(tmp, ROUTES_PATH)
+    except OSError as e:
+        log(f"Could not save routing table to {ROUTES_PATH}: {e}", QUIET)
+
+route_cache = load_route_cache()
+# measured decoding time of each hop in ms per source character, e.g. {"fr-en": 0.8};
+# model loading and worker startup are not part of it
+hop_latency = route_cache.setdefault("latency", {})
+
+def record_hop_latency(hop, ms, chars):
+    if chars:
+        key = f"{hop[0]}-{hop[1]}"
+        sample = ms / chars
+        old = hop_latency.get(key)
+        hop_latency[key] = round(sample if old is None else 0.7 * old + 0.3 * sample, 4)
+
+def pivot_bias(lang):
+    # below ROUTE_PIVOT_BIAS for preferred pivots, in PIVOT_ORDER order
+    if lang in pivot_order:
+        return ROUTE_PIVOT_BIAS * (pivot_order.index(lang) + 1) / (len(pivot_order) + 1)
+    return ROUTE_PIVOT_BIAS
+
+def edge_cost(a, b):
+    # a hop never measured is assumed as fast as the average measured one, not free
+    prior = sum(hop_latency.values()) / len(hop_latency) if hop_latency else 0.0
+    cost = 1.0 + ROUTE_LATENCY_WEIGHT * round(hop_latency.get(f"{a}-{b}", prior), 1)
+    if (a, b) not in installed_index and (a, b) not in mirror_index:
+        cost += ROUTE_INSTALL_COST
+    # every route to a target enters it once, so the bias only ranks the pivots
+    return cost + pivot_bias(b)
+
+def routing_version():
+    key = [
+        sorted(f"{p.from_code}-{p.to_code}@{getattr(p, 'package_version', '?')}" for p in available),
+        sorted(f"{a}-{b}@{getattr(p, 'package_version', '?')}" for (a, b), p in installed_index.items()),
+        sorted(f"{a}-{b}@{e.get('package_version', '?')}" for (a, b), e in mirror_index.items()),
+        pivot_order, ROUTE_LATENCY_WEIGHT, ROUTE_INSTALL_COST, ROUTE_PIVOT_BIAS, OFFLINE,
+        sorted((hop, round(ms, 1)) for hop, ms in hop_latency.items()),
+    ]
+    return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+
+def shortest_routes(src):
+    """Cheapest route from src to every reachable language: {dst: {"route": [...], "cost": c}}."""
+    dist, prev = {src: 0.0}, {}
+    heap = [(0.0, src)]
+    done = set()
+    while heap:
+        d, node = heapq.heappop(heap)
+        if node in done:
+            continue
+        done.add(node)
+        for n in sorted(neighbors(node)):
+            nd = d + edge_cost(node, n)
+            if n not in done and nd < dist.get(n, math.inf):
+                dist[n], prev[n] = nd, node
+                heapq.heappush(heap, (nd, n))
+    routes = {}
+    for dst in sorted(done - {src}):
+        path = [dst]
+        while path[-1] != src:
+            path.append(prev[path[-1]])
+        routes[dst] = {"route": path[::-1], "cost": round(dist[dst] - pivot_bias(dst), 3)}
+    return routes
+
+def build_routing_table():
+    version = routing_version()
+    routing_table.clear()
+    if route_cache.get("version") == version:
+        routing_table.update(route_cache.get("routes", {}))
+        log(f"Routing table loaded from {ROUTES_PATH}")
+        return
+    with span("routing_table") as sp:
+        for src in sorted(graph):
+            routing_table[src] = shortest_routes(src)
+        sp.update(languages=len(routing_table), pairs=sum(len(r) for r in routing_table.values()))
+    route_cache.update(version=version, routes=routing_table)
+    save_route_cache()
+
+def refresh_package_index():
+    global available
+    log("Updating package index...")
+    with span("index_refresh") as sp:
+        argostranslate.package.update_package_index()
+        available = load_available_packages()
+        sp["available"] = len(available)
+    log(f"Available packages count: {len(available)}")
+    build_graph()
+    build_routing_table()
+
+# ---------- Determine translation routes ----------
+def plan_route(src, dst):
     if src == dst:
         return [src]
-    # BFS with optional ordering of neighbors to prefer pivots
-    q = collections.deque([[src]])
-    seen = {src}
-    while q:
-        path = q.popleft()
-        node = path[-1]
-        nbrs = list(neighbors(node))
-        # If preferred pivots available, order neighbors so they are enqueued earlier
-        if preferred_pivots:
-            def score(n):
-                try:
-                    # lower score = higher priority (appear earlier)
-                    return preferred_pivots.index(n)
-                except ValueError:
-                    return len(preferred_pivots) + 1
-            nbrs.sort(key=score)
-        for n in nbrs:
-            if n in seen:
-                continue
-            new_path = path + [n]
-            if n == dst:
-                return new_path
-            seen.add(n)
-            q.append(new_path)
+    entry = routing_table.get(src, {}).get(dst)
+    if not entry:
+        return None
+    log(f"Route found: {' -> '.join(entry['route'])} (cost {entry['cost']})")
+    return entry["route"]
+
+def plan_routes():
+    routes = {}
+    for dst in TARGETS:
+        with span("plan.route", src=SRC, dst=dst) as sp:
+            route = plan_route(SRC, dst)
+            sp["route"] = " -> ".join(route) if route else None
+        if not route:
+            log(f"No translation path found for {SRC} -> {dst}")
+            return None
+        routes[dst] = route
+    return routes
+
+def routes_local(routes):
+    # every hop is installed or can be installed from the mirror
+    return routes is not None and all(
+        hop in installed_index or hop in mirror_index
+        for route in routes.values() for hop in zip(route[:-1], route[1:]))
+
+# route of each target and the hops they need (shared hops are listed once)
+routes = {}
+needed_pairs = []
+
+def plan():
+    global routes
+    build_graph()
+    build_routing_table()
+    with span("plan"):
+        routes = plan_routes()
+    if routes_local(routes):
+        log("All needed models are installed or mirrored; package index not refreshed")
+    elif not OFFLINE and not index_fresh:
+        refresh_package_index()
+        with span("plan"):
+            routes = plan_routes()
+    if not routes:
+        log("❌ No translation path found. Listing available edges for debugging:", QUIET)
+        log(f"Available from {SRC}: {sorted(neighbors(SRC))}", QUIET)
+        for dst in TARGETS:
+            log(f"Available to   {dst}: {sorted(a for a, tos in graph.items() if dst in tos)}", QUIET)
+        raise SystemExit(1)
+    needed_pairs[:] = dict.fromkeys(hop for route in routes.values() for hop in zip(route[:-1], route[1:]))
+    log(f"Needed pairs to install: {needed_pairs}")
+
+# ---------- Model downloads (concurrent, resumable, verified) ----------
+# Packages missing from the planned routes are fetched in parallel into argos'
+# downloads dir. Data is written to "<file>.part" first and an interrupted download
+# resumes from it with an HTTP Range request. A finished file must match the sha256
+# of its index entry (when the index has one) and be a valid zip archive.
+download_lock = threading.Lock()
+download_progress = {"total": 0, "done": 0, "start": 0.0, "logged": 0.0}
+
+def index_checksums():
+    try:
+        with open(argostranslate.settings.local_package_index, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, ValueError, AttributeError):
+        return {}
+    return {(e.get("from_code"), e.get("to_code")): (e.get("sha256") or e.get("checksum")).lower()
+            for e in entries if isinstance(e, dict) and (e.get("sha256") or e.get("checksum"))}
+
+def package_file_name(pkg):
+    # same name as argos' own AvailablePackage.download() uses
+    return f"translate-{pkg.from_code}_{pkg.to_code}.argosmodel"
+
+def package_urls(pkg):
+    links = list(getattr(pkg, "links", None) or [])
+    if MODEL_BASE_URL:
+        names = [os.path.basename(urllib.parse.urlparse(link).path) for link in links]
+        return [f"{MODEL_BASE_URL}/{name}" for name in dict.fromkeys(names or [package_file_name(pkg)])]
+    return links
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def verify_package(path, checksum):
+    if checksum and file_sha256(path) != checksum:
+        return "checksum mismatch"
+    if not zipfile.is_zipfile(path):
+        return "not a valid .argosmodel archive"
     return None
 
-# If user provided a pivot order, convert it into preference list for BFS:
-preferred = PIVOT_PREFERRED if PIVOT_PREFERRED else None
-
-# ---------- Determine translation route ----------
-path = find_path(SRC, DST, preferred)
-if path:
-    log(f"Direct path found: {' -> '.join(path)}")
-else:
-    # try one-step pivot attempts using preferred pivots explicitly
-    if preferred:
-        log("No direct path; trying explicit pivot candidates from PIVOT_ORDER...")
-        for pivot in preferred:
-            p = find_path(SRC, DST, [pivot])
-            if p:
-                path = p
-                log(f"Path via preferred pivot found: {' -> '.join(path)}")
-                break
-    # last attempt: try automatic via common pivots (e.g., en)
-    if not path:
-        COMMON_PIVOTS = ["en", "fr", "de", "es"]
-        log("No path found yet; trying automatic common pivots...")
-        for pivot in COMMON_PIVOTS:
-            if pivot == SRC or pivot == DST: 
-                continue
-            # try SRC -> pivot and pivot -> DST
-            if (pivot in neighbors(SRC)) and (DST in neighbors(pivot)):
-                path = [SRC, pivot, DST]
-                log(f"Found path via common pivot '{pivot}': {' -> '.join(path)}")
-                break
-
-if not path:
-    log("❌ No translation path found. Listing available edges for debugging:")
-    log(f"Available from {SRC}: {sorted(neighbors(SRC))}")
-    log(f"Available to   {DST}: {[p.from_code for p in available if p.to_code==DST]}")
-    raise SystemExit(1)
+def report_download(total=0, done=0, final=False):
+    with download_lock:
+        p = download_progress
+        p["total"] += total
+        p["done"] += done
+        now = time.perf_counter()
+        if not p["total"] or (not final and now - p["logged"] < 2):
+            return
+        p["logged"] = now
+        rate = p["done"] / max(now - p["start"], 1e-9) / 1e6
+        pct = f" ({100 * p['done'] // p['total']}%)" if p["total"] else ""
+        log(f"Downloaded {p['done'] / 1e6:.1f} / {p['total'] / 1e6:.1f} MB{pct}, {rate:.1f} MB/s")
 
-# ---------- Ensure required models installed (install missing ones on the path edges) ----------
-# Build list of needed pairs
-needed_pairs = list(zip(path[:-1], path[1:]))
-log(f"Needed pairs to install: {needed_pairs}")
-
-# Determine already installed languages (codes)
-installed_langs = argostranslate.translate.load_installed_languages()
-installed_pairs = set()
-for src_lang in installed_langs:
-    for to_lang in installed_langs:
-        if src_lang.code != to_lang.code:
-            # try to get translation object; if it exists, assume pair available
+def fetch(url, part, record):
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    request = urllib.request.Request(url, headers={"Range": f"bytes={offset}-"} if offset else {})
+    try:
+        response = urllib.request.urlopen(request, timeout=60)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and offset:
+            # nothing left to fetch: the part file is already complete
+            return
+        raise
+    with response:
+        if offset and response.status != 206:
+            offset = 0  # the server ignored the range, start over
+        length = int(response.headers.get("Content-Length") or 0)
+        record["resumed_from"] = offset
+        if "size" not in record:
+            # first attempt of this run: the part file comes from an earlier run
+            record["size"] = offset + length
+            report_download(total=offset + length, done=offset)
+        received = 0
+        with open(part, "ab" if offset else "wb") as f:
+            while True:
+                block = response.read(1 << 20)
+                if not block:
+                    break
+                f.write(block)
+                received += len(block)
+                record["bytes"] = record.get("bytes", 0) + len(block)
+                report_download(done=len(block))
+        if received < length:
+            # connection dropped: keep the part file, the next attempt resumes it
+            raise http.client.IncompleteRead(b"", length - received)
+
+def download_package(pkg, checksum, record):
+    """Download pkg into argos' downloads dir; returns the file path, or None on failure."""
+    argostranslate.settings.downloads_dir.mkdir(parents=True, exist_ok=True)
+    dest = argostranslate.settings.downloads_dir / package_file_name(pkg)
+    if dest.exists() and verify_package(dest, checksum) is None:
+        record["cached"] = True
+        return dest
+    part = f"{dest}.part"
+    errors = []
+    for url in package_urls(pkg):
+        for _ in range(DOWNLOAD_RETRIES):
             try:
-                trans = src_lang.get_translation(to_lang)
-                if trans:
-                    installed_pairs.add((src_lang.code, to_lang.code))
-            except Exception:
-                pass
-
-def install_pair(src, dst):
-    if (src, dst) in installed_pairs:
+                fetch(url, part, record)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(f"{url}: {e}")
+                continue
+            problem = verify_package(part, checksum)
+            if problem is None:
+                os.replace(part, dest)
+                return dest
+            # a corrupt file is not resumed: its bytes are fetched again
+            report_download(done=-os.path.getsize(part))
+            os.remove(part)
+            errors.append(f"{url}: {problem}")
+    log(f"Download of {pkg.from_code}->{pkg.to_code} failed: {'; '.join(errors[-DOWNLOAD_RETRIES:]) or 'no link'}", QUIET)
+    return None
+
+def download_packages(pairs):
+    """Fetch the packages of pairs concurrently; returns {(src, dst): path or None}."""
+    if not pairs:
+        return {}
+    if OFFLINE:
+        for src, dst in pairs:
+            log(f"Offline mode: cannot download package {src}->{dst}", QUIET)
+        return {}
+    pkgs = {}
+    for src, dst in pairs:
+        pkg = next((p for p in available if p.from_code == src and p.to_code == dst), None)
+        if pkg:
+            pkgs[(src, dst)] = pkg
+        else:
+            log(f"Package not available for {src}->{dst}", QUIET)
+    if not pkgs:
+        return {}
+    checksums = index_checksums()
+    workers = min(DOWNLOAD_WORKERS, len(pkgs))
+    download_progress.update(total=0, done=0, start=time.perf_counter(), logged=time.perf_counter())
+    log(f"Downloading {len(pkgs)} package(s), {workers} at a time ...")
+
+    def download(pair):
+        with span("install.download", src=pair[0], dst=pair[1], verified=pair in checksums) as sp:
+            path = download_package(pkgs[pair], checksums.get(pair), sp)
+            sp["ok"] = path is not None
+        return path
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        paths = dict(zip(pkgs, pool.map(download, pkgs)))
+    report_download(final=True)
+    return paths
+
+def install_pair(src, dst, path_pkg):
+    if (src, dst) in installed_index:
         log(f"Pair {src} -> {dst} already installed")
         return True
-    pkg = next((p for p in available if p.from_code == src and p.to_code == dst), None)
-    if not pkg:
-        log(f"Package not available for {src}->{dst}")
+    if path_pkg is None:
         return False
-    log(f"Downloading package {src} -> {dst} ...")
-    path_pkg = pkg.download()
     log(f"Installing {path_pkg} ...")
-    argostranslate.package.install_from_path(path_pkg)
-    # refresh installed_langs
-    try:
-        new_installed = argostranslate.translate.load_installed_languages()
-        # update installed_pairs accordingly (quick update)
-        for src_lang in new_installed:
-            for to_lang in new_installed:
-                if src_lang.code != to_lang.code:
-                    try:
-                        if src_lang.get_translation(to_lang):
-                            installed_pairs.add((src_lang.code, to_lang.code))
-                    except Exception:
-                        pass
-    except Exception:
-        pass
-    return (src, dst) in installed_pairs
+    try:
+        argostranslate.package.install_from_path(path_pkg)
+    except Exception as e:
+        log(f"Install of {path_pkg} failed: {e}", QUIET)
+        return False
+    installed_index[(src, dst)] = next((p for p in argostranslate.package.get_installed_packages()
+                                        if p.from_code == src and p.to_code == dst), None)
+    return True
+
+def mirror_package(src, dst):
+    entry = mirror_index[(src, dst)]
+    problem = verify_package(entry["path"], (entry.get("sha256") or "").lower() or None)
+    if problem:
+        log(f"Mirror package {entry['path']} rejected: {problem}", QUIET)
+        return None
+    log(f"Using mirrored package {entry['path']}")
+    return entry["path"]
 
-all_installed = True
-for s, d in needed_pairs:
-    ok = install_pair(s, d)
-    if not ok:
-        log(f"❌ Failed to install model for {s}->{d}")
-        all_installed = False
+# ---------- Ensure required models installed (install missing ones on the path edges) ----------
+def install_models():
+    all_installed = True
+    with span("install", pairs=len(needed_pairs)):
+        missing = [hop for hop in needed_pairs if hop not in installed_index]
+        local = {hop: mirror_package(*hop) for hop in missing if hop in mirror_index}
+        downloads = download_packages([hop for hop in missing if local.get(hop) is None])
+        downloads.update((hop, path) for hop, path in local.items() if path)
+        for s, d in needed_pairs:
+            with span("install.pair", src=s, dst=d, cached=(s, d) in installed_index) as sp:
+                ok = install_pair(s, d, downloads.get((s, d)))
+                sp["ok"] = ok
+            if not ok:
+                log(f"❌ Failed to install model for {s}->{d}", QUIET)
+                all_installed = False
 
-if not all_installed:
-    raise SystemExit(1)
+    if not all_installed:
+        raise SystemExit(1)
 
 # ---------- Translation function (chain if needed) ----------
-def translate_text(text, route):
+# Translation objects are resolved once per hop, at startup, and reused for every
+# key and file: argostranslate.translate.translate() would look up the installed
+# languages again on each call.
+hop_translations = {}
+
+def get_hop_translation(a, b):
+    if (a, b) not in hop_translations:
+        translation = argostranslate.translate.get_translation_from_codes(a, b)
+        if translation is None:
+            raise RuntimeError(f"No installed translation for {a} -> {b}")
+        hop_translations[(a, b)] = translation
+    return hop_translations[(a, b)]
+
+def route_translations(route):
+    return [get_hop_translation(a, b) for a, b in zip(route[:-1], route[1:])]
+
+def resolve_hops():
+    with span("resolve", hops=len(needed_pairs)):
+        for a, b in needed_pairs:
+            get_hop_translation(a, b)
+
+def translate_text(text, route, translations=None):
     # route is list of language codes e.g. ['fr','en','es']
     current = text
-    for i in range(len(route)-1):
-        a = route[i]
-        b = route[i+1]
-        current = argostranslate.translate.translate(current, a, b)
+    for translation in translations or route_translations(route):
+        ensure_model(translation)
+        current = translate_messages([current], lambda texts: [translation.translate(t) for t in texts])[0]
     return current
 
-# ---------- Process files: write into TMP_OUTPUT first ----------
-log(f"Reading input dir: {INPUT_DIR}")
-files = [f for f in os.listdir(INPUT_DIR) if f.endswith(".arb")]
-log(f"Found files: {files}")
+# ---------- ICU MessageFormat (translate the text, keep the syntax) ----------
+# A value is parsed into runs: ("text", s), ("arg", s) for a placeholder ({name},
+# {n, number}, "#" in a plural) and ("choice", parts) for a plural/select, whose
+# parts alternate its syntax ("{count, plural, one {", "} other {", "}") and the
+# runs of each branch. Each message (the value itself and every branch) goes to
+# the model whole, its placeholders and choices replaced by {0}, {1}... so the
+# model keeps the sentence together and can move them; they are put back after.
+# Apostrophes are plain text, as in Flutter's gen-l10n. Values that don't parse as
+# ICU are translated whole.
+ICU_ARG_RE = re.compile(r"\{\s*([^\s{},]+)\s*(?:,\s*([A-Za-z]+)\s*)?")
+ICU_BRANCH_RE = re.compile(r"\s*(?:offset:\s*\d+\s+)?(=?[^\s{}]+)\s*\{")
+ICU_CLOSE_RE = re.compile(r"\s*\}")
+ICU_WORD_RE = re.compile(r"[^\W\d_]")
+ICU_SENTINEL_RE = re.compile(r"\{\d+\}")
+
+def icu_message(text, pos, in_plural):
+    # parses a message up to the "}" closing it (or the end); returns its runs and that position
+    runs, start = [], pos
+    while pos < len(text) and text[pos] != "}":
+        if text[pos] == "{" or (text[pos] == "#" and in_plural):
+            if pos > start:
+                runs.append(("text", text[start:pos]))
+            if text[pos] == "#":
+                runs.append(("arg", "#"))
+                pos += 1
+            else:
+                run, pos = icu_argument(text, pos, in_plural)
+                runs.append(run)
+            start = pos
+        else:
+            pos += 1
+    if pos > start:
+        runs.append(("text", text[start:pos]))
+    return runs, pos
+
+def icu_argument(text, pos, in_plural):
+    m = ICU_ARG_RE.match(text, pos)
+    if not m:
+        raise ValueError(f"bad ICU argument at {pos}")
+    kind, end = m.group(2), m.end()
+    if kind is None or text[end:end + 1] == "}" or kind not in ("plural", "select", "selectordinal"):
+        # {name}, {n, number}, {d, date, short}...: copied as a whole
+        depth = 0
+        for end in range(pos, len(text)):
+            depth += {"{": 1, "}": -1}.get(text[end], 0)
+            if depth == 0:
+                return ("arg", text[pos:end + 1]), end + 1
+        raise ValueError("unbalanced braces")
+    if text[end:end + 1] != ",":
+        raise ValueError(f"expected ',' at {end}")
+    parts, syntax_start, pos = [], pos, end + 1
+    in_plural = in_plural or kind != "select"
+    while True:
+        m = ICU_CLOSE_RE.match(text, pos)
+        if m:
+            parts.append(text[syntax_start:m.end()])
+            return ("choice", parts), m.end()
+        m = ICU_BRANCH_RE.match(text, pos)
+        if not m:
+            raise ValueError(f"bad ICU branch at {pos}")
+        parts.append(text[syntax_start:m.end()])
+        branch, pos = icu_message(text, m.end(), in_plural)
+        parts.append(branch)
+        if pos >= len(text):
+            raise ValueError("unterminated ICU branch")
+        # the "}" closing the branch starts the next syntax part
+        syntax_start, pos = pos, pos + 1
+
+def icu_parse(text):
+    """Runs of text as an ICU message; a single text run when it is not one."""
+    if "{" not in text and "}" not in text:
+        return [("text", text)]
+    try:
+        runs, end = icu_message(text, 0, False)
+        if end != len(text):
+            raise ValueError("unbalanced braces")
+    except ValueError:
+        return [("text", text)]
+    return runs
+
+def icu_mask(runs):
+    """(message with {0}, {1}... in place of its non-text runs, those runs)."""
+    masked, args = [], []
+    for kind, value in runs:
+        if kind == "text":
+            masked.append(value)
+        else:
+            masked.append(f"{{{len(args)}}}")
+            args.append((kind, value))
+    return "".join(masked), args
+
+def icu_core(masked):
+    # what goes to the model: surrounding spaces stay out, messages without letters are kept
+    core = masked.strip()
+    return core if ICU_WORD_RE.search(ICU_SENTINEL_RE.sub("", core)) else None
+
+def icu_cores(runs):
+    """Model inputs of a parsed value: its message and those of every branch."""
+    masked, args = icu_mask(runs)
+    cores = [icu_core(masked)] if icu_core(masked) else []
+    for kind, value in args:
+        if kind == "choice":
+            cores.extend(core for branch in value if not isinstance(branch, str) for core in icu_cores(branch))
+    return cores
+
+def icu_render(runs, done):
+    """Text of parsed runs, each message replaced by its translation in done (if any)."""
+    masked, args = icu_mask(runs)
+    core = icu_core(masked)
+    if core in done:
+        lead = len(masked) - len(masked.lstrip())
+        masked = masked[:lead] + done[core] + masked[lead + len(core):]
+    if not args:
+        return masked
+
+    def arg_text(m):
+        kind, value = args[int(m.group()[1:-1])]
+        if kind == "arg":
+            return value
+        return "".join(part if isinstance(part, str) else icu_render(part, done) for part in value)
+    return ICU_SENTINEL_RE.sub(arg_text, masked)
+
+def icu_placeholders_kept(core, translated):
+    return sorted(ICU_SENTINEL_RE.findall(core)) == sorted(ICU_SENTINEL_RE.findall(translated))
+
+def icu_fragments(core):
+    """[(translatable, piece)] of a message cut at its placeholders, joining back into core."""
+    pieces = []
+    for piece in re.split(f"({ICU_SENTINEL_RE.pattern})", core):
+        if ICU_SENTINEL_RE.fullmatch(piece) or not ICU_WORD_RE.search(piece):
+            pieces.append((False, piece))
+            continue
+        lead, trail = piece[:len(piece) - len(piece.lstrip())], piece[len(piece.rstrip()):]
+        pieces.extend(p for p in ((False, lead), (True, piece.strip()), (False, trail)) if p[1])
+    return [p for p in pieces if p[1]]
+
+def translate_messages(texts, translate_many):
+    """translate_many(list of str) -> list of str, applied to the messages of texts only."""
+    if not ICU_MESSAGES:
+        return translate_many(texts)
+    parsed = [icu_parse(t) for t in texts]
+    cores = list(dict.fromkeys(core for runs in parsed for core in icu_cores(runs)))
+    done = dict(zip(cores, translate_many(cores)))
+    # a message whose translation lost (or repeated) a placeholder is translated piece by piece
+    lost = {core: icu_fragments(core) for core in cores if not icu_placeholders_kept(core, done[core])}
+    if lost:
+        fragments = list(dict.fromkeys(p for pieces in lost.values() for translatable, p in pieces if translatable))
+        out = dict(zip(fragments, translate_many(fragments)))
+        for core, pieces in lost.items():
+            done[core] = "".join(out[p] if translatable else p for translatable, p in pieces)
+    return [icu_render(runs, done) for runs in parsed]
+
+# ---------- Batched translation (one decoder call per hop for many strings) ----------
+# Values that look like several sentences or paragraphs go through the regular
+# argos path, which splits them before decoding; short UI strings are batched.
+MULTI_SENTENCE_RE = re.compile(r"[.!?]\s+\S")
+
+def package_translation(translation):
+    """Unwrap argos' CachedTranslation down to the PackageTranslation holding the model."""
+    while translation is not None and not hasattr(translation, "pkg"):
+        translation = getattr(translation, "underlying", None)
+    return translation
+
+# fastest settings found by "autotune" for each pair, only used on a machine
+# with the same number of cores
+def load_tuning():
+    try:
+        with open(TUNING_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+tuning = load_tuning() if TUNING_PATH else {}
+tuned_pairs = tuning.get("pairs", {}) if tuning.get("cpus") == os.cpu_count() else {}
+# settings being tried by autotune, ahead of everything else
+ct2_override = {}
+
+def ct2_settings(pkg):
+    tuned = tuned_pairs.get(f"{pkg.from_code}-{pkg.to_code}", {})
+    if WORKERS > 1:
+        # each worker already got its share of the cores in init_worker
+        tuned = {k: v for k, v in tuned.items() if k != "intra_threads"}
+    return {
+        "inter_threads": ct2_override.get("inter_threads") or CT2_INTER_THREADS or tuned.get("inter_threads")
+                         or argostranslate.settings.inter_threads,
+        "intra_threads": ct2_override.get("intra_threads") or CT2_INTRA_THREADS or tuned.get("intra_threads")
+                         or argostranslate.settings.intra_threads,
+        "compute_type": ct2_override.get("compute_type") or CT2_COMPUTE_TYPE or tuned.get("compute_type")
+                        or "default",
+    }
+
+# ---------- Model pool: loaded models under a memory budget ----------
+# Every CTranslate2 model is loaded through load_ct2_translator, which keeps them
+# in least recently used order with their size (the size of the model files,
+# close to what an int8 model takes in memory). Loading one that does not fit in
+# memory_budget_mb first unloads the least recently used others.
+model_pool = collections.OrderedDict()   # ptrans -> size in MB, most recent last
+pool_stats = {"loads": 0, "evictions": 0, "peak_mb": 0.0}
+memory_budget_mb = MODEL_MEMORY_MB
+
+def model_size_mb(ptrans):
+    total = 0
+    for root, _, fnames in os.walk(ptrans.pkg.package_path / "model"):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in fnames)
+    return total / (1024 * 1024)
+
+def pair_name(ptrans):
+    return f"{ptrans.pkg.from_code}->{ptrans.pkg.to_code}"
+
+def release_model(ptrans):
+    # the model is freed with the last reference to its translator
+    model_pool.pop(ptrans, None)
+    ptrans.translator = None
+
+def load_ct2_translator(ptrans):
+    if getattr(ptrans, "translator", None) is not None and ptrans in model_pool:
+        model_pool.move_to_end(ptrans)
+        return ptrans.translator
+    release_model(ptrans)
+    size = model_size_mb(ptrans)
+    if memory_budget_mb:
+        while model_pool and sum(model_pool.values()) + size > memory_budget_mb:
+            old, old_size = next(iter(model_pool.items()))
+            release_model(old)
+            pool_stats["evictions"] += 1
+            log(f"Unloaded model {pair_name(old)} ({old_size:.0f} MB) to stay under {memory_budget_mb:.0f} MB")
+        if size > memory_budget_mb:
+            log(f"Model {pair_name(ptrans)} ({size:.0f} MB) alone exceeds MODEL_MEMORY_MB", QUIET)
+    import ctranslate2
+    ptrans.translator = ctranslate2.Translator(
+        str(ptrans.pkg.package_path / "model"),
+        device=argostranslate.settings.device,
+        **ct2_settings(ptrans.pkg),
+    )
+    model_pool[ptrans] = size
+    in_use = sum(model_pool.values())
+    pool_stats["loads"] += 1
+    pool_stats["peak_mb"] = max(pool_stats["peak_mb"], in_use)
+    log(f"Loaded model {pair_name(ptrans)} ({size:.0f} MB, {in_use:.0f} MB loaded)")
+    return ptrans.translator
+
+def ensure_model(translation):
+    # per-string translation goes through argos, which would load the model outside the pool
+    ptrans = package_translation(translation)
+    if getattr(getattr(ptrans, "pkg", None), "tokenizer", None) is not None:
+        load_ct2_translator(ptrans)
+
+# decoder batches of this process (workers send theirs back with each unit)
+batch_stats = {"batches": 0, "segments": 0, "tokens": 0, "padded": 0, "decode_ms": 0.0, "decoded_chars": 0}
+
+def schedule_batches(lengths):
+    """Split indexes into batches of similar length: at most BATCH_SIZE items and,
+    with BATCH_TOKENS, at most that many tokens once padded to the longest."""
+    batches, current = [], []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # sorted, so lengths[i] is the longest of the batch if i joins it
+        if current and (len(current) >= BATCH_SIZE or
+                        (BATCH_TOKENS and lengths[i] * (len(current) + 1) > BATCH_TOKENS)):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+def translate_hop_batch(translation, texts):
+    ptrans = package_translation(translation)
+    tokenizer = getattr(getattr(ptrans, "pkg", None), "tokenizer", None)
+    if tokenizer is None:
+        # no access to the underlying model (older argos, pivot composite...): per-string
+        return [translation.translate(t) for t in texts]
+
+    # loaded here so the per-string path below uses the same settings
+    translator = load_ct2_translator(ptrans)
+    # only the decoding below is timed (route planning latency), not the model load
+    start = time.perf_counter()
+    results = list(texts)
+    batch_idx, batch_tokens = [], []
+    for i, text in enumerate(texts):
+        if not text.strip():
+            continue
+        batch_stats["decoded_chars"] += len(text)
+        if "\n" in text or MULTI_SENTENCE_RE.search(text):
+            results[i] = translation.translate(text)
+        else:
+            batch_idx.append(i)
+            batch_tokens.append(tokenizer.encode(text))
+    if not batch_tokens:
+        batch_stats["decode_ms"] += (time.perf_counter() - start) * 1000
+        return results
+
+    prefix = getattr(ptrans.pkg, "target_prefix", "")
+    lengths = [len(tokens) for tokens in batch_tokens]
+    for batch in schedule_batches(lengths):
+        out = translator.translate_batch(
+            [batch_tokens[j] for j in batch],
+            target_prefix=[[prefix]] * len(batch) if prefix else None,
+            replace_unknowns=True,
+            max_batch_size=BATCH_SIZE,
+            beam_size=4,
+            num_hypotheses=1,
+            length_penalty=0.2,
+        )
+        batch_stats["batches"] += 1
+        batch_stats["segments"] += len(batch)
+        batch_stats["tokens"] += sum(lengths[j] for j in batch)
+        batch_stats["padded"] += lengths[batch[-1]] * len(batch)
+        # results go back to the position of their string in texts
+        for j, res in zip(batch, out):
+            tokens = res.hypotheses[0]
+            if prefix:
+                tokens = tokens[1:]
+            value = tokenizer.decode(tokens)
+            # the tokenizer adds a space at the beginning of the translation
+            if value.startswith(" "):
+                value = value[1:]
+            results[batch_idx[j]] = value
+    batch_stats["decode_ms"] += (time.perf_counter() - start) * 1000
+    return results
+
+def translate_batch(texts, route, translations=None):
+    # same as translate_text, but every hop decodes the whole list at once
+    if translations is None:
+        translations = route_translations(route)
+    current = list(texts)
+    for translation in translations:
+        current = translate_messages(current, lambda texts: translate_hop_batch(translation, texts))
+    return current
+
+def translate_safe(texts, route, translations=None):
+    # batched first; if the batch fails, retry string by string (None = failed)
+    try:
+        return translate_batch(texts, route, translations)
+    except Exception as e:
+        log(f"Batch translation failed ({e}); falling back to per-string translation", QUIET)
+    results = []
+    for text in texts:
+        try:
+            results.append(translate_text(text, route, translations))
+        except Exception as e:
+            log(f"Translation error for {text!r}: {e}", QUIET)
+            results.append(None)
+    return results
+
+# ---------- Translation memory (skip the model for strings already translated) ----------
+# Entries are keyed on the full route and on the installed package version of
+# every hop, so upgrading a model or changing pivots never serves stale text.
+def open_translation_memory(db_path):
+    if not db_path:
+        return None
+    safe_makedirs(os.path.dirname(db_path) or ".")
+    try:
+        db = sqlite3.connect(db_path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " route TEXT NOT NULL, models TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL,"
+            " PRIMARY KEY (route, models, source))"
+        )
+        return db
+    except Exception as e:
+        log(f"Translation memory disabled, cannot open {db_path}: {e}", QUIET)
+        return None
+
+models_keys = {}
+
+def route_models_key(route):
+    route = tuple(route)
+    if route not in models_keys:
+        models_keys[route] = ",".join(
+            f"{a}-{b}@{getattr(installed_index.get((a, b)), 'package_version', '?')}"
+            for a, b in zip(route[:-1], route[1:]))
+        if ICU_MESSAGES:
+            # ICU-aware translations differ from whole-string ones: don't mix them
+            models_keys[route] += ";icu"
+    return models_keys[route]
+
+tm_db = None
+tm_stats = {"hits": 0, "misses": 0}
+
+# sources looked up per query: SQLite builds before 3.32 allow 999 parameters
+TM_LOOKUP_CHUNK = 900
+
+def tm_lookup(route, texts):
+    known = {}
+    if tm_db is None or len(route) < 2:
+        return known
+    route_key = " -> ".join(route)
+    sources = list(set(texts))
+    for i in range(0, len(sources), TM_LOOKUP_CHUNK):
+        chunk = sources[i:i + TM_LOOKUP_CHUNK]
+        # served by the (route, models, source) primary key index
+        known.update(tm_db.execute(
+            "SELECT source, target FROM translations WHERE route = ? AND models = ? AND source IN "
+            f"({', '.join('?' * len(chunk))})",
+            (route_key, route_models_key(route), *chunk),
+        ))
+    return known
+
+def tm_store(route, pairs):
+    if tm_db is None or len(route) < 2 or not pairs:
+        return
+    route_key = " -> ".join(route)
+    tm_db.executemany(
+        "INSERT OR REPLACE INTO translations (route, models, source, target) VALUES (?, ?, ?, ?)",
+        [(route_key, route_models_key(route), src, dst) for src, dst in pairs],
+    )
+    tm_db.commit()
+
+# ---------- Worker pool (WORKERS > 1) ----------
+# Workers are forked after setup, so they inherit config and the resolved hop
+# translations; each one loads its own models for the hops it is given.
+worker_route = None
+worker_translations = None
+
+def init_worker(route, workers):
+    global worker_route, worker_translations
+    if "ARGOS_INTRA_THREADS" not in os.environ and not CT2_INTRA_THREADS:
+        # share the cores between workers instead of oversubscribing them
+        argostranslate.settings.intra_threads = max(1, (os.cpu_count() or 1) // workers)
+    worker_route = route
+    worker_translations = route_translations(route)
+    # models loaded by the parent are not reused across the fork
+    for ptrans in list(model_pool):
+        release_model(ptrans)
+    for translation in worker_translations:
+        ptrans = package_translation(translation)
+        if ptrans is not None and hasattr(ptrans, "translator"):
+            ptrans.translator = None
+    global memory_budget_mb
+    memory_budget_mb = MODEL_MEMORY_MB / workers
+
+def translate_unit(texts):
+    for stats in (batch_stats, pool_stats):
+        for k in stats:
+            stats[k] = 0
+    out = translate_safe(texts, worker_route, worker_translations)
+    return out, dict(batch_stats), dict(pool_stats)
+
+def run_units(units, route):
+    # units are translated in order, sequentially or by the pool, so both give the same output
+    total = sum(len(unit) for unit in units)
+    progress = {"done": 0, "next": PROGRESS_EVERY, "start": time.perf_counter()}
 
-for fname in files:
-    in_path = os.path.join(INPUT_DIR, fname)
-    out_tmp = os.path.join(TMP_OUTPUT, fname)
-    out_final = os.path.join(FINAL_OUTPUT, fname)
+    def advance(n):
+        # aggregated progress line every PROGRESS_EVERY strings instead of per-key output
+        progress["done"] += n
+        if progress["done"] >= progress["next"] and progress["done"] < total:
+            progress["next"] = (progress["done"] // PROGRESS_EVERY + 1) * PROGRESS_EVERY
+            rate = progress["done"] / max(time.perf_counter() - progress["start"], 1e-9)
+            log(f"Progress {' -> '.join(route)}: {progress['done']}/{total} strings "
+                f"({rate:.1f}/s, ETA {(total - progress['done']) / rate:.0f}s)")
 
-    log(f"Processing '{fname}'")
-    with open(in_path, "r", encoding="utf-8") as rf:
-        data = json.load(rf)
+    outputs = []
+    if WORKERS > 1 and len(units) > 1:
+        nproc = min(WORKERS, len(units))
+        log(f"Translating {len(units)} work units ({' -> '.join(route)}) with {nproc} worker processes")
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(nproc, initializer=init_worker, initargs=(route, nproc)) as pool:
+            for out, stats, models in pool.imap(translate_unit, units, chunksize=1):
+                outputs.append(out)
+                for k, v in stats.items():
+                    batch_stats[k] += v
+                pool_stats["loads"] += models["loads"]
+                pool_stats["evictions"] += models["evictions"]
+                pool_stats["peak_mb"] = max(pool_stats["peak_mb"], models["peak_mb"])
+                advance(len(out))
+    else:
+        for unit in units:
+            outputs.append(translate_safe(unit, route))
+            advance(len(unit))
+    return outputs
 
+dedup_stats = {"strings": 0, "unique": 0}
+
+def translate_files(jobs):
+    """
+    jobs: {route: [{key: source string} per file]}, the strings each route needs.
+    Strings found in the translation memory are reused, and each distinct source
+    string is translated once per hop no matter how many keys or files use it.
+    The routes form a tree rooted at the source language: each hop prefix (e.g.
+    fr -> en) is translated once and its output feeds every route below it. Work
+    is cut into units, one per file or CHUNK_KEYS-sized chunks of large files.
+    Returns {route: [{key: translation} per file]}; keys that failed are left out.
+    """
+    jobs = {tuple(r): files for r, files in jobs.items()}
+    nfiles = len(next(iter(jobs.values()), []))
+    known, missing = {}, {}
+    for route, files in jobs.items():
+        if len(route) < 2:
+            continue
+        all_texts = [t for job in files for t in job.values()]
+        known[route] = tm_lookup(route, all_texts)
+        missing[route] = [{t for t in job.values() if t not in known[route]} for job in files]
+        pending = sum(1 for t in all_texts if t not in known[route])
+        tm_stats["hits"] += len(all_texts) - pending
+        tm_stats["misses"] += pending
+
+    # at[prefix] = {source: text translated along prefix}; None at the root (source itself)
+    at = {}
+    for prefix in sorted({r[:i] for r in missing for i in range(2, len(r) + 1)}, key=len):
+        below = [r for r in missing if r[:len(prefix)] == prefix]
+        parent = at.get(prefix[:-1])
+        units = []
+        seen = set()
+        for i in range(nfiles):
+            pending = {t for r in below for t in missing[r][i] if parent is None or t in parent}
+            # a string already queued for an earlier file (or key) is not sent again
+            order = dict.fromkeys(t for r in below for t in jobs[r][i].values())
+            needed = [t for t in order if t in pending and t not in seen]
+            seen.update(needed)
+            dedup_stats["strings"] += len({k for r in below for k, t in jobs[r][i].items() if t in pending})
+            dedup_stats["unique"] += len(needed)
+            for j in range(0, len(needed), CHUNK_KEYS):
+                units.append(needed[j:j + CHUNK_KEYS])
+        if not units:
+            at[prefix] = {}
+            continue
+        inputs = [[parent[t] for t in unit] if parent is not None else unit for unit in units]
+        before = dict(batch_stats)
+        with span("translate.hop", hop=" -> ".join(prefix[-2:]), units=len(units),
+                  strings=sum(len(u) for u in inputs), chars=sum(len(t) for u in inputs for t in u)) as sp:
+            outputs = run_units(inputs, list(prefix[-2:]))
+            sp.update({k: batch_stats[k] - before[k] for k in ("batches", "tokens", "padded")})
+            sp["decode_ms"] = round(batch_stats["decode_ms"] - before["decode_ms"], 3)
+        record_hop_latency(prefix[-2:], sp["decode_ms"], batch_stats["decoded_chars"] - before["decoded_chars"])
+        # strings that failed (None) are not passed further down the tree
+        at[prefix] = {src: dst for unit, out in zip(units, outputs)
+                      for src, dst in zip(unit, out) if dst is not None}
+
+    results = {}
+    for route, files in jobs.items():
+        if len(route) < 2:
+            results[route] = [dict(job) for job in files]
+            continue
+        translated = at.get(route, {})
+        tm_store(route, list(translated.items()))
+        known[route].update(translated)
+        results[route] = [{k: known[route][t] for k, t in job.items() if t in known[route]} for job in files]
+    return results
+
+# ---------- Incremental mode (reuse previous output for unchanged keys) ----------
+# The snapshot stores, for every output file, the route and model versions it
+# was produced with and a hash of each key's source value.
+SNAPSHOT_PATH = os.path.join(FINAL_OUTPUT, ".translater-snapshot.json")
+
+def value_hash(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+def load_snapshot():
+    if not INCREMENTAL:
+        return {}
+    try:
+        with open(SNAPSHOT_PATH, "r", encoding="utf-8") as rf:
+            return json.load(rf).get("files", {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log(f"Ignoring unreadable snapshot {SNAPSHOT_PATH}: {e}", QUIET)
+        return {}
+
+def save_snapshot(files):
+    tmp = SNAPSHOT_PATH + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as wf:
+            json.dump({"files": files}, wf, ensure_ascii=False)
+        os.replace(tmp, SNAPSHOT_PATH)
+    except Exception as e:
+        log(f"Failed to write snapshot {SNAPSHOT_PATH}: {e}", QUIET)
+
+def reusable_translations(entry, route, prev_path, data, keys):
+    # previous translations of the keys whose source value did not change
+    if not entry or entry.get("route") != " -> ".join(route) or entry.get("models") != route_models_key(route):
+        return {}
+    try:
+        with open(prev_path, "r", encoding="utf-8") as rf:
+            prev = json.load(rf)
+    except Exception:
+        return {}
+    hashes = entry.get("keys", {})
+    return {k: prev[k] for k in keys
+            if isinstance(prev.get(k), str) and hashes.get(k) == value_hash(data[k])}
+
+def output_name(dst, fname):
+    # with several targets, each locale gets its own sub-directory
+    return os.path.join(dst, fname) if len(TARGETS) > 1 else fname
+
+def build_result(data, dst, prev, translated):
+    # output ARB: previous translations of unchanged keys, then new ones, else the source
     result = {}
     for k, v in data.items():
         if k == "@@locale":
-            result[k] = DST
-        elif isinstance(v, str):
+            result[k] = dst
+        elif k in prev:
+            result[k] = prev[k]
+        elif k in translated:
+            result[k] = translated[k]
+            log(f"  {k}: {v} -> {translated[k]}", DEBUG)
+        else:
+            result[k] = v
+    return result
+
+def string_keys(data):
+    return [k for k, v in data.items() if k != "@@locale" and isinstance(v, str)]
+
+# strings (and their characters) sent to translate_files by run_files
+run_stats = {"strings": 0, "chars": 0}
+
+def log_summary():
+    if dedup_stats["strings"]:
+        saved = dedup_stats["strings"] - dedup_stats["unique"]
+        log(f"Deduplication: {dedup_stats['strings']} strings to translate, {dedup_stats['unique']} unique "
+            f"({saved} model inputs saved, {100 * saved // dedup_stats['strings']}%)")
+    if tm_db is not None:
+        log(f"Translation memory: {tm_stats['hits']} hits, {tm_stats['misses']} misses")
+    if pool_stats["loads"]:
+        log(f"Models: {pool_stats['loads']} loads, {pool_stats['evictions']} evictions, "
+            f"peak {pool_stats['peak_mb']:.0f} MB loaded" +
+            (f" (budget {MODEL_MEMORY_MB:.0f} MB)" if MODEL_MEMORY_MB else ""))
+        emit_metric({"models": {**pool_stats, "peak_mb": round(pool_stats["peak_mb"], 1),
+                                "budget_mb": MODEL_MEMORY_MB}})
+    if batch_stats["batches"]:
+        padding = 1 - batch_stats["tokens"] / max(batch_stats["padded"], 1)
+        log(f"Batching: {batch_stats['segments']} segments in {batch_stats['batches']} batches "
+            f"(BATCH_SIZE {BATCH_SIZE}, BATCH_TOKENS {BATCH_TOKENS}), {100 * padding:.1f}% padding")
+        emit_metric({"batching": {**batch_stats, "decode_ms": round(batch_stats["decode_ms"], 3),
+                                  "batch_size": BATCH_SIZE, "batch_tokens": BATCH_TOKENS,
+                                  "padding": round(padding, 4)}})
+
+def translate_jobs(jobs):
+    # translate_files wrapped in the "translate" span with its counts
+    n_strings = sum(len(job) for files in jobs.values() for job in files)
+    n_chars = sum(len(t) for files in jobs.values() for job in files for t in job.values())
+    run_stats["strings"] += n_strings
+    run_stats["chars"] += n_chars
+    hits, misses, unique = tm_stats["hits"], tm_stats["misses"], dedup_stats["unique"]
+    with span("translate", strings=n_strings, chars=n_chars) as sp:
+        results = translate_files(jobs)
+        sp.update(tm_hits=tm_stats["hits"] - hits, tm_misses=tm_stats["misses"] - misses,
+                  unique=dedup_stats["unique"] - unique)
+    return results
+
+# ---------- Streaming ARB reader/writer (catalogs too big to load at once) ----------
+def iter_arb(path, chunk_size=1 << 16):
+    """Yield the (key, value) pairs of an ARB file in file order, reading it incrementally."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as rf:
+        buf, pos, eof = "", 0, False
+
+        def more():
+            # drop what was consumed and read at least as much as is pending,
+            # so a huge value is re-parsed a logarithmic number of times
+            nonlocal buf, pos, eof
+            data = rf.read(max(chunk_size, len(buf) - pos))
+            eof = not data
+            buf, pos = buf[pos:] + data, 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                more()
+
+        def decode():
+            # a value is only complete once the delimiter after it has been read,
+            # otherwise a number cut by the buffer ("1." of "1.5") would parse
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    if eof or (end < len(buf) and buf[end] in " \t\r\n,:]}"):
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                more()
+
+        def expect(chars):
+            nonlocal pos
+            skip_ws()
+            ch = buf[pos:pos + 1]
+            if ch not in chars:
+                raise ValueError(f"{path}: expected one of {chars!r}, got {ch!r}")
+            pos += 1
+            return ch
+
+        expect("{")
+        skip_ws()
+        if buf[pos:pos + 1] == "}":
+            return
+        while True:
+            skip_ws()
+            key = decode()
+            expect(":")
+            skip_ws()
+            yield key, decode()
+            if expect(",}") == "}":
+                return
+
+class ArbWriter:
+    """Write key/value pairs one at a time, byte-identical to json.dump(obj, indent=2, ensure_ascii=False)."""
+
+    def __init__(self, path):
+        self.f = open(path, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, key, value):
+        value_json = json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        self.f.write(("{\n  " if self.count == 0 else ",\n  ") + json.dumps(key, ensure_ascii=False) + ": " + value_json)
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n}" if self.count else "{}")
+        self.f.close()
+
+def stream_file(fname):
+    # keys are translated STREAM_CHUNK at a time and written out in input order;
+    # incremental reuse does not apply here, the translation memory still does
+    writers = {}
+    for dst in routes:
+        out_tmp = os.path.join(TMP_OUTPUT, output_name(dst, fname))
+        safe_makedirs(os.path.dirname(out_tmp))
+        writers[dst] = ArbWriter(out_tmp)
+
+    def flush(chunk):
+        data = dict(chunk)
+        job = {k: data[k] for k in string_keys(data)}
+        results = translate_jobs({tuple(route): [job] for route in routes.values()})
+        for dst, route in routes.items():
+            result = build_result(data, dst, {}, results[tuple(route)][0])
+            for k, v in result.items():
+                writers[dst].write(k, v)
+
+    with span("stream", file=fname) as sp:
+        chunk, keys = [], 0
+        try:
+            for pair in iter_arb(os.path.join(INPUT_DIR, fname)):
+                chunk.append(pair)
+                if len(chunk) >= STREAM_CHUNK:
+                    flush(chunk)
+                    keys += len(chunk)
+                    chunk = []
+            if chunk:
+                flush(chunk)
+                keys += len(chunk)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        sp["keys"] = keys
+    log(f"Streamed '{fname}' ({keys} keys) to {', '.join(writers)}")
+    return [output_name(dst, fname) for dst in routes]
+
+# ---------- Publish TMP_OUTPUT to FINAL_OUTPUT ----------
+# A file is copied to a temp name next to its destination and moved into place
+# with os.replace, so readers of the output volume never see a partial file. Files
+# whose content did not change are left alone (their mtime too).
+def publish_file(srcp, dstp):
+    """Returns True when dstp was replaced, False when it already had this content."""
+    if os.path.exists(dstp) and os.path.getsize(dstp) == os.path.getsize(srcp) \
+            and file_sha256(dstp) == file_sha256(srcp):
+        return False
+    safe_makedirs(os.path.dirname(dstp))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dstp), prefix=f".{os.path.basename(dstp)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as wf, open(srcp, "rb") as rf:
+            shutil.copyfileobj(rf, wf)
+            wf.flush()
+            os.fsync(wf.fileno())
+        shutil.copystat(srcp, tmp)
+        os.replace(tmp, dstp)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return True
+
+def publish(names):
+    # only the files produced by this run: leftovers in TMP_OUTPUT are ignored
+    log("Publishing tmp -> final output...")
+    with span("sync", files=len(names)) as sp:
+        sp["changed"] = 0
+        for name in names:
+            srcp = os.path.join(TMP_OUTPUT, name)
+            dstp = os.path.normpath(os.path.join(FINAL_OUTPUT, name))
             try:
-                translated = translate_text(v, path)
+                if publish_file(srcp, dstp):
+                    sp["changed"] += 1
+                    log(f"Published {srcp} -> {dstp}")
+                else:
+                    log(f"Unchanged {dstp}", DEBUG)
             except Exception as e:
-                log(f"Translation error for key {k}: {e}")
-                translated = v
-            result[k] = translated
-            log(f"  {k}: {v} -> {translated}")
+                log(f"Failed to publish {srcp} -> {dstp}: {e}", QUIET)
+    log(f"Published {sp['changed']} changed files, {len(names) - sp['changed']} unchanged")
+
+# ---------- Input discovery (recursive, INCLUDE / EXCLUDE) ----------
+# Files are named by their path relative to INPUT_DIR ("pkg/lib/l10n/app_fr.arb")
+# and written to the same relative path in the output. Hidden directories, the
+# output directories and excluded directories are not entered.
+def path_matches(rel, patterns):
+    return any(fnmatch.fnmatchcase(rel, p) or (p.startswith("**/") and fnmatch.fnmatchcase(rel, p[3:]))
+               for p in patterns)
+
+def is_input_dir(rel):
+    return not any(part.startswith(".") for part in rel.split("/")) and not path_matches(rel, EXCLUDE) \
+        and os.path.realpath(os.path.join(INPUT_DIR, rel)) not in (os.path.realpath(TMP_OUTPUT),
+                                                                    os.path.realpath(FINAL_OUTPUT))
+
+def is_input_file(rel):
+    return not os.path.basename(rel).startswith(".") and path_matches(rel, INCLUDE) \
+        and not path_matches(rel, EXCLUDE)
+
+def walk_input(rel=""):
+    """Yield (relative path, is_dir) for the directories and input files below rel."""
+    try:
+        entries = os.scandir(os.path.join(INPUT_DIR, rel))
+    except FileNotFoundError:
+        if not rel:
+            raise
+        # removed while being walked (git checkout, editor temp directory...): nothing below it
+        return
+    with entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            path = rel + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if is_input_dir(path):
+                    yield path, True
+                    yield from walk_input(path + "/")
+            elif entry.is_file() and is_input_file(path):
+                yield path, False
+
+def discover_files():
+    return [path for path, is_dir in walk_input() if not is_dir]
+
+# ---------- Sharding across nodes (SHARD_INDEX / SHARD_COUNT) ----------
+# The string keys of a file are cut into SHARD_KEYS-sized ranges in file order;
+# each (file, target, range) unit belongs to the shard given by a stable hash of
+# its name, so every node computes the same partition without coordination. A
+# node writes one partial file per output it has units of, holding the
+# translations of its keys; "merge" rebuilds each output from the partials with
+# the same build_result as a single-node run.
+def unit_shard(fname, dst, chunk):
+    return int(hashlib.sha1(f"{fname}|{dst}|{chunk}".encode("utf-8")).hexdigest(), 16) % SHARD_COUNT
+
+def key_shards(fname, dst, keys):
+    """Shard of each SHARD_KEYS range of keys, in order."""
+    return [unit_shard(fname, dst, c) for c in range(math.ceil(len(keys) / SHARD_KEYS))]
+
+def shard_keys(fname, dst, keys):
+    owners = key_shards(fname, dst, keys)
+    return [k for i, k in enumerate(keys) if owners[i // SHARD_KEYS] == SHARD_INDEX]
+
+def shard_name(name, shard):
+    return f"{name}.{shard}-of-{SHARD_COUNT}.json"
+
+def owned_hashes(fname, dst, data, keys, shard):
+    # source hash of every key of the shard: what its translations were made from
+    owners = key_shards(fname, dst, keys)
+    return {k: value_hash(data[k]) for i, k in enumerate(keys) if owners[i // SHARD_KEYS] == shard}
+
+def write_shard(fname, dst, route, data, keys, translated):
+    """Write this node's partial output of fname for dst; returns the names produced."""
+    hashes = owned_hashes(fname, dst, data, keys, SHARD_INDEX)
+    if not hashes:
+        return []
+    name = os.path.join(".shards", shard_name(output_name(dst, fname), SHARD_INDEX))
+    out_tmp = os.path.join(TMP_OUTPUT, name)
+    safe_makedirs(os.path.dirname(out_tmp))
+    with span("write", file=name, keys=len(hashes)):
+        with open(out_tmp, "w", encoding="utf-8") as wf:
+            json.dump({"route": " -> ".join(route), "models": route_models_key(route), "shard_keys": SHARD_KEYS,
+                       "keys": hashes, "translations": {k: translated[k] for k in hashes if k in translated}},
+                      wf, ensure_ascii=False, indent=2)
+    log(f"Wrote shard {SHARD_INDEX}/{SHARD_COUNT} of '{fname}' ({dst}): {len(hashes)} keys")
+    return [name]
+
+def read_shard(path, expected):
+    """Translations of a partial file; ValueError when it was not made from the current input."""
+    with open(path, "r", encoding="utf-8") as rf:
+        partial = json.load(rf)
+    if partial.get("shard_keys") != SHARD_KEYS:
+        raise ValueError(f"written with SHARD_KEYS={partial.get('shard_keys')}, not {SHARD_KEYS}")
+    if partial.get("keys") != expected:
+        raise ValueError("keys or source values differ from the current input")
+    translations = partial["translations"]
+    if not isinstance(translations, dict) or not set(translations) <= set(expected):
+        raise ValueError("translations of keys it does not own")
+    return partial
+
+def merge():
+    log(f"Merging {SHARD_COUNT} shards from {SHARD_DIR}")
+    produced, rejected = [], []
+    # every partial of a target must come from the same route and model versions
+    target_models = {}
+    for fname in discover_files():
+        with open(os.path.join(INPUT_DIR, fname), "r", encoding="utf-8") as rf:
+            data = json.load(rf)
+        keys = string_keys(data)
+        for dst in TARGETS:
+            name = output_name(dst, fname)
+            translated = {}
+            with span("merge", file=name) as sp:
+                for shard in sorted(set(key_shards(fname, dst, keys))):
+                    path = os.path.join(SHARD_DIR, shard_name(name, shard))
+                    try:
+                        partial = read_shard(path, owned_hashes(fname, dst, data, keys, shard))
+                        models = (partial.get("route"), partial.get("models"))
+                        if target_models.setdefault(dst, models) != models:
+                            raise ValueError(f"made with {models[0]} ({models[1]}), other shards of {dst} "
+                                             f"with {target_models[dst][0]} ({target_models[dst][1]})")
+                        translated.update(partial["translations"])
+                    except (OSError, ValueError, KeyError) as e:
+                        rejected.append(path)
+                        log(f"❌ Missing, unreadable or stale shard {path}: {e}", QUIET)
+                sp["keys"] = len(translated)
+                out_tmp = os.path.join(TMP_OUTPUT, name)
+                safe_makedirs(os.path.dirname(out_tmp))
+                with open(out_tmp, "w", encoding="utf-8") as wf:
+                    json.dump(build_result(data, dst, {}, translated), wf, ensure_ascii=False, indent=2)
+            produced.append(name)
+    if rejected:
+        # an incomplete merge would publish source text (or outdated translations) for those keys
+        log(f"❌ {len(rejected)} shard files missing or stale, nothing published", QUIET)
+        raise SystemExit(1)
+    publish(produced)
+
+# ---------- Process files: write into TMP_OUTPUT first ----------
+def run_files(only=None):
+    # only: names of the files to process (watch mode), all .arb files by default
+    log(f"Reading input dir: {INPUT_DIR}")
+    files = [f for f in discover_files() if only is None or f in only]
+    log(f"Found files: {files}")
+
+    # large files are streamed after the others, see stream_file
+    threshold = STREAM_THRESHOLD_MB * 1024 * 1024
+    streamed = [f for f in files if not SHARDED and os.path.getsize(os.path.join(INPUT_DIR, f)) >= threshold]
+    if streamed:
+        log(f"Streaming large files: {streamed}")
+
+    docs = []
+    for fname in files:
+        if fname in streamed:
+            continue
+        log(f"Loading '{fname}'")
+        with span("read", file=fname) as sp:
+            with open(os.path.join(INPUT_DIR, fname), "r", encoding="utf-8") as rf:
+                data = json.load(rf)
+            docs.append((fname, data, string_keys(data)))
+            sp["keys"] = len(docs[-1][2])
+
+    snapshot = load_snapshot()
+    new_snapshot = {}
+    produced = []
+    reused = {}
+    jobs = {}
+    for dst, route in routes.items():
+        jobs[tuple(route)] = []
+        for fname, data, keys in docs:
+            name = output_name(dst, fname)
+            prev = reusable_translations(snapshot.get(name), route, os.path.join(FINAL_OUTPUT, name), data, keys)
+            reused[name] = prev
+            owned = shard_keys(fname, dst, keys) if SHARDED else keys
+            jobs[tuple(route)].append({k: data[k] for k in owned if k not in prev})
+    if INCREMENTAL:
+        n_reused = sum(len(prev) for prev in reused.values())
+        n_todo = sum(len(job) for files in jobs.values() for job in files)
+        log(f"Incremental: {n_reused} keys unchanged since last run, {n_todo} to translate")
+
+    # translate the string values of all files to every target, then map them back to their keys
+    translated_per_route = translate_jobs(jobs)
+
+    for dst, route in routes.items():
+        for (fname, data, keys), translated in zip(docs, translated_per_route[tuple(route)]):
+            name = output_name(dst, fname)
+            if SHARDED:
+                produced.extend(write_shard(fname, dst, route, data, keys, translated))
+                continue
+            out_tmp = os.path.join(TMP_OUTPUT, name)
+            safe_makedirs(os.path.dirname(out_tmp))
+            prev = reused[name]
+
+            log(f"Processing '{fname}' ({dst})")
+            with span("write", file=name, keys=len(keys), reused=len(prev)):
+                result = build_result(data, dst, prev, translated)
+
+                # write in tmp output
+                with open(out_tmp, "w", encoding="utf-8") as wf:
+                    json.dump(result, wf, ensure_ascii=False, indent=2)
+            log(f"Wrote tmp output: {out_tmp}")
+            produced.append(name)
+
+            # keys that failed to translate are left out so the next run retries them
+            new_snapshot[name] = {
+                "route": " -> ".join(route),
+                "models": route_models_key(route),
+                "keys": {k: value_hash(data[k]) for k in keys if k in prev or k in translated},
+            }
+
+    for fname in streamed:
+        produced.extend(stream_file(fname))
+
+    publish(produced)
+
+    if INCREMENTAL:
+        # entries of the files not processed this time are kept
+        save_snapshot(new_snapshot if only is None else {**snapshot, **new_snapshot})
+
+# ---------- Serve mode: models stay loaded, jobs arrive over HTTP ----------
+# POST /translate {"texts": [...]}      -> {"translations": {locale: [...]}}
+# POST /arb       {ARB object}          -> {locale: translated ARB object}
+# GET  /health
+# Both POST endpoints accept ?target=es,de to restrict the configured targets.
+def translate_strings(texts, targets):
+    jobs = {tuple(routes[dst]): [dict(enumerate(texts))] for dst in targets}
+    results = translate_files(jobs)
+    return {dst: [results[tuple(routes[dst])][0].get(i, t) for i, t in enumerate(texts)] for dst in targets}
+
+def translate_arb(data, targets):
+    keys = string_keys(data)
+    jobs = {tuple(routes[dst]): [{k: data[k] for k in keys}] for dst in targets}
+    results = translate_files(jobs)
+    return {dst: build_result(data, dst, {}, results[tuple(routes[dst])][0]) for dst in targets}
+
+class TranslateHandler(http.server.BaseHTTPRequestHandler):
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urllib.parse.urlparse(self.path).path == "/health":
+            self.send_json(200, {"status": "ok", "source": SRC, "targets": TARGETS})
         else:
-            result[k] = v
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path not in ("/translate", "/arb"):
+            self.send_json(404, {"error": "not found"})
+            return
+        query = urllib.parse.parse_qs(url.query)
+        targets = [t for v in query.get("target", []) for t in v.split(",") if t] or TARGETS
+        unknown = [t for t in targets if t not in routes]
+        if unknown:
+            self.send_json(400, {"error": f"targets not served: {unknown}", "targets": TARGETS})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if url.path == "/translate":
+                if not isinstance(body, dict):
+                    raise ValueError('body must be a JSON object with "texts"')
+                texts = body.get("texts")
+                if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                    raise ValueError('"texts" must be a list of strings')
+                self.send_json(200, {"translations": translate_strings(texts, targets)})
+            else:
+                if not isinstance(body, dict):
+                    raise ValueError("ARB body must be a JSON object")
+                self.send_json(200, translate_arb(body, targets))
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+        except Exception as e:
+            log(f"Request {url.path} failed: {e}", QUIET)
+            self.send_json(500, {"error": str(e)})
+
+    def log_message(self, fmt, *args):
+        # client_address is empty on UNIX sockets, so don't use the default format
+        log(fmt % args)
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    pass
 
-    # write in tmp output
-    with open(out_tmp, "w", encoding="utf-8") as wf:
-        json.dump(result, wf, ensure_ascii=False, indent=2)
-    log(f"Wrote tmp output: {out_tmp}")
+def load_models():
+    # load every hop's model up front instead of on the first translation
+    with span("model_load", models=len(needed_pairs)):
+        for a, b in needed_pairs:
+            ptrans = package_translation(get_hop_translation(a, b))
+            if getattr(getattr(ptrans, "pkg", None), "tokenizer", None) is not None:
+                load_ct2_translator(ptrans)
+    log(f"Models loaded for: {needed_pairs}")
 
-# ---------- Copy from TMP_OUTPUT to FINAL_OUTPUT (volume) ----------
-log("Syncing tmp -> final output (overwriting)...")
-for f in os.listdir(TMP_OUTPUT):
-    srcp = os.path.join(TMP_OUTPUT, f)
-    dstp = os.path.join(FINAL_OUTPUT, f)
+def serve():
+    load_models()
+
+    if SERVE_SOCKET:
+        if os.path.exists(SERVE_SOCKET):
+            os.remove(SERVE_SOCKET)
+        server = UnixHTTPServer(SERVE_SOCKET, TranslateHandler)
+        log(f"Serving on unix socket {SERVE_SOCKET}")
+    else:
+        server = http.server.HTTPServer((SERVE_HOST, SERVE_PORT), TranslateHandler)
+        log(f"Serving on http://{SERVE_HOST}:{SERVE_PORT}")
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
     try:
-        shutil.copy2(srcp, dstp)
-        log(f"Copied {srcp} -> {dstp}")
-    except Exception as e:
-        log(f"Failed to copy {srcp} -> {dstp}: {e}")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("Stopping server")
+    finally:
+        server.server_close()
+        if SERVE_SOCKET and os.path.exists(SERVE_SOCKET):
+            os.remove(SERVE_SOCKET)
+
+# ---------- Benchmark mode: synthetic corpus, per-stage timings ----------
+BENCH_VOCABULARY = (
+    "compte paramètres enregistrer annuler supprimer modifier rechercher message profil "
+    "notification mot de passe utilisateur fichier dossier envoyer recevoir ouvrir fermer "
+    "nouveau ancien aujourd'hui demain erreur succès connexion déconnexion bienvenue aide "
+    "langue thème sombre clair valider confirmer retour suivant précédent télécharger partager"
+).split()
+BENCH_PLACEHOLDER_NAMES = ["name", "count", "date", "email"]
+
+def generate_corpus(out_dir, files, keys, mean_words, dup_ratio, placeholder_ratio, seed):
+    """
+    Write `files` ARB files of `keys` string keys each. Value lengths follow a
+    log-normal distribution around `mean_words` words, `dup_ratio` of the values
+    repeat an earlier one and `placeholder_ratio` of them contain an ICU placeholder
+    (with its "@key" metadata entry).
+    """
+    rng = random.Random(seed)
+    safe_makedirs(out_dir)
+    values = []
+    for f in range(files):
+        data = {"@@locale": SRC}
+        for i in range(keys):
+            key = f"bench{f}_{i}"
+            if values and rng.random() < dup_ratio:
+                value = rng.choice(values)
+            else:
+                n = max(1, round(rng.lognormvariate(math.log(mean_words), 0.6)))
+                words = [rng.choice(BENCH_VOCABULARY) for _ in range(n)]
+                if rng.random() < placeholder_ratio:
+                    words.insert(rng.randrange(len(words) + 1), "{" + rng.choice(BENCH_PLACEHOLDER_NAMES) + "}")
+                value = " ".join(words).capitalize()
+                values.append(value)
+            data[key] = value
+            names = re.findall(r"\{(\w+)\}", value)
+            if names:
+                data["@" + key] = {"placeholders": {name: {} for name in names}}
+        with open(os.path.join(out_dir, f"bench_{f}.arb"), "w", encoding="utf-8") as wf:
+            json.dump(data, wf, ensure_ascii=False, indent=2)
+
+def report_bench():
+    log("---- BENCHMARK ----", QUIET)
+    for stage, secs in stage_times.items():
+        if "." not in stage:
+            log(f"{stage:<14} {secs * 1000:10.1f} ms", QUIET)
+    secs = stage_times.get("translate", 0.0)
+    rates = {
+        "strings": run_stats["strings"],
+        "chars": run_stats["chars"],
+        "strings_per_sec": run_stats["strings"] / secs if secs else 0.0,
+        "chars_per_sec": run_stats["chars"] / secs if secs else 0.0,
+    }
+    log(f"translated {rates['strings']} strings ({rates['chars']} chars): "
+        f"{rates['strings_per_sec']:.1f} strings/s, {rates['chars_per_sec']:.1f} chars/s", QUIET)
+    if BENCH_REPORT:
+        report = {
+            "corpus": {"files": BENCH_FILES, "keys": BENCH_KEYS, "words": BENCH_WORDS,
+                       "dup_ratio": BENCH_DUP_RATIO, "placeholders": BENCH_PLACEHOLDERS, "seed": BENCH_SEED},
+            "routes": {dst: route for dst, route in routes.items()},
+            "stages_ms": {stage: secs * 1000 for stage, secs in stage_times.items() if "." not in stage},
+            **rates,
+        }
+        with open(BENCH_REPORT, "w", encoding="utf-8") as wf:
+            json.dump(report, wf, indent=2)
+        log(f"Benchmark report written to {BENCH_REPORT}", QUIET)
+
+def bench():
+    for sub in (INPUT_DIR, TMP_OUTPUT, FINAL_OUTPUT):
+        shutil.rmtree(sub, ignore_errors=True)
+    generate_corpus(INPUT_DIR, BENCH_FILES, BENCH_KEYS, BENCH_WORDS, BENCH_DUP_RATIO, BENCH_PLACEHOLDERS, BENCH_SEED)
+    log(f"Generated {BENCH_FILES} files x {BENCH_KEYS} keys in {INPUT_DIR}")
+    load_models()
+    run_files()
+    report_bench()
+
+# ---------- Watch mode: re-translate input files when they change ----------
+# inotify (through libc) tells which files were written, moved or deleted, in
+# INPUT_DIR and every input sub-directory (new ones are added as they appear);
+# where it is not available the tree is polled every WATCH_POLL seconds. Each
+# watcher is a function waiting up to `timeout` seconds (None = forever) and
+# returning the relative paths that changed.
+IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x8, 0x40, 0x80, 0x100, 0x200
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+def inotify_watcher(path):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            return None
+    except (OSError, AttributeError):
+        return None
+    dirs = {}  # watch descriptor -> directory relative to path ("" or "sub/dir/")
+
+    def add(rel):
+        wd = libc.inotify_add_watch(fd, os.fsencode(os.path.join(path, rel)), WATCH_MASK)
+        if wd >= 0:
+            dirs[wd] = rel
+        return wd
+
+    if add("") < 0:
+        os.close(fd)
+        return None
+    for rel, is_dir in walk_input():
+        if is_dir:
+            add(rel + "/")
+
+    def wait(timeout):
+        if not select.select([fd], [], [], timeout)[0]:
+            return set()
+        data, names, pos = os.read(fd, 64 * 1024), set(), 0
+        while pos + 16 <= len(data):
+            # struct inotify_event: wd, mask, cookie, len, then the name
+            wd, mask, _, length = struct.unpack_from("iIII", data, pos)
+            rel = dirs.get(wd, "") + os.fsdecode(data[pos + 16:pos + 16 + length].rstrip(b"\0"))
+            pos += 16 + length
+            if not mask & IN_ISDIR:
+                names.add(rel)
+            elif mask & (IN_CREATE | IN_MOVED_TO) and is_input_dir(rel) and add(rel + "/") >= 0:
+                # a new directory: watch it and everything already in it
+                for sub, is_dir in walk_input(rel + "/"):
+                    if is_dir:
+                        add(sub + "/")
+                    else:
+                        names.add(sub)
+        return names
+    return wait
+
+def poll_watcher(path):
+    def scan():
+        state = {}
+        for rel in discover_files():
+            try:
+                st = os.stat(os.path.join(path, rel))
+            except FileNotFoundError:
+                # deleted since it was listed: the next scan reports it gone
+                continue
+            state[rel] = (st.st_mtime_ns, st.st_size)
+        return state
+    seen = {"files": scan()}
+
+    def wait(timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(WATCH_POLL if deadline is None else max(0.0, min(WATCH_POLL, deadline - time.monotonic())))
+            current = scan()
+            changed = {n for n in current.keys() | seen["files"].keys() if current.get(n) != seen["files"].get(n)}
+            seen["files"] = current
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+    return wait
+
+def remove_outputs(files):
+    # input files deleted or moved away: their outputs and snapshot entries go too
+    names = [output_name(dst, fname) for fname in files for dst in routes]
+    for name in names:
+        for path in (os.path.join(TMP_OUTPUT, name), os.path.join(FINAL_OUTPUT, name)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                log(f"Failed to remove {path}: {e}", QUIET)
+                continue
+            if path.startswith(FINAL_OUTPUT):
+                log(f"Removed {path}")
+    if INCREMENTAL:
+        snapshot = load_snapshot()
+        save_snapshot({name: entry for name, entry in snapshot.items() if name not in names})
+
+def watch():
+    wait = inotify_watcher(INPUT_DIR)
+    log(f"Watching {INPUT_DIR} for changes ({'inotify' if wait else 'polling'}), Ctrl+C to stop", QUIET)
+    wait = wait or poll_watcher(INPUT_DIR)
+    known = set(discover_files())
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            try:
+                changed = set(wait(None))
+                # a save often comes as several events: wait until the directory is quiet
+                while True:
+                    more = wait(WATCH_DEBOUNCE_MS / 1000)
+                    if not more:
+                        break
+                    changed |= more
+            except OSError as e:
+                # e.g. INPUT_DIR itself replaced by a checkout: keep watching
+                log(f"❌ Watch error: {e}", QUIET)
+                time.sleep(WATCH_POLL)
+                continue
+            if not os.path.isdir(INPUT_DIR):
+                # the whole input directory is missing, most likely for a moment: keep the outputs
+                continue
+            present = sorted(n for n in changed if is_input_file(n) and os.path.isfile(os.path.join(INPUT_DIR, n)))
+            # checked on every change: a directory moved away takes its files without an event each
+            gone = sorted(n for n in known if not os.path.isfile(os.path.join(INPUT_DIR, n)))
+            known = (known | set(present)) - set(gone)
+            if gone:
+                log(f"Removed from input: {gone}")
+                remove_outputs(gone)
+            if not present:
+                continue
+            log(f"Changed: {present}")
+            try:
+                with span("watch.update", files=len(present)):
+                    run_files(only=set(present))
+            except Exception as e:
+                # e.g. a file saved with a JSON error: keep watching
+                log(f"❌ Update failed: {e}", QUIET)
+    except KeyboardInterrupt:
+        log("Watch stopped", QUIET)
+
+# ---------- Autotune mode: fastest CTranslate2 settings per language pair ----------
+# Every hop of the planned routes translates a sample of the input strings with
+# each combination of compute type and inter/intra threads that fits the cores;
+# the fastest one is saved to TUNING_PATH and used by the following runs.
+def sample_input_strings(n):
+    texts = []
+    for fname in discover_files():
+        with open(os.path.join(INPUT_DIR, fname), "r", encoding="utf-8") as rf:
+            data = json.load(rf)
+        texts.extend(data[k] for k in string_keys(data))
+    texts = list(dict.fromkeys(texts))
+    return random.Random(0).sample(texts, n) if len(texts) > n else texts
+
+def thread_grid(cpus):
+    intra = sorted({n for n in (1, 2, 4, 8, 16, 32, 64) if n <= cpus} | {cpus})
+    return [(inter, i) for i in intra for inter in sorted({1, cpus // i})]
+
+def tune_pair(a, b, texts):
+    """Returns (best settings with their rate, hop outputs) or (None, outputs)."""
+    translation = get_hop_translation(a, b)
+    ptrans = package_translation(translation)
+    if getattr(getattr(ptrans, "pkg", None), "tokenizer", None) is None:
+        log(f"Autotune {a}-{b}: model not reachable through CTranslate2, skipped", QUIET)
+        return None, translate_hop_batch(translation, texts)
+    best, outputs = None, None
+    for compute_type in AUTOTUNE_COMPUTE_TYPES:
+        for inter, intra in thread_grid(os.cpu_count() or 1):
+            ct2_override.update(inter_threads=inter, intra_threads=intra, compute_type=compute_type)
+            release_model(ptrans)
+            try:
+                with span("autotune.trial", pair=f"{a}-{b}", settings=f"{compute_type} {inter}x{intra}") as sp:
+                    translate_hop_batch(translation, texts[:8])  # model load and warm-up
+                    start = time.perf_counter()
+                    out = translate_hop_batch(translation, texts)
+                    rate = len(texts) / max(time.perf_counter() - start, 1e-9)
+                    sp["strings_per_sec"] = round(rate, 1)
+            except Exception as e:
+                # e.g. a compute type the device does not support
+                log(f"Autotune {a}-{b} {compute_type} {inter}x{intra}: {e}", QUIET)
+                continue
+            log(f"Autotune {a}-{b}: {compute_type}, inter {inter}, intra {intra}: {rate:.1f} strings/s")
+            if best is None or rate > best["strings_per_sec"]:
+                best = {"compute_type": compute_type, "inter_threads": inter, "intra_threads": intra,
+                        "strings_per_sec": round(rate, 1)}
+                outputs = out
+    ct2_override.clear()
+    release_model(ptrans)
+    return best, outputs if outputs is not None else translate_hop_batch(translation, texts)
+
+def autotune():
+    texts = sample_input_strings(AUTOTUNE_SAMPLE)
+    if not texts:
+        log(f"❌ No strings to tune on in {INPUT_DIR}", QUIET)
+        raise SystemExit(1)
+    log(f"Autotuning on {len(texts)} strings from {INPUT_DIR}")
+    pairs = dict(tuned_pairs)
+    inputs = {SRC: texts}
+    for route in routes.values():
+        for a, b in zip(route[:-1], route[1:]):
+            if b in inputs:
+                continue
+            # a hop is tuned on what the previous hop produced, as in a real run
+            best, inputs[b] = tune_pair(a, b, inputs[a])
+            if best:
+                pairs[f"{a}-{b}"] = best
+                log(f"Fastest for {a}-{b}: {best['compute_type']}, inter {best['inter_threads']}, "
+                    f"intra {best['intra_threads']} ({best['strings_per_sec']} strings/s)", QUIET)
+    if not TUNING_PATH:
+        return
+    safe_makedirs(os.path.dirname(TUNING_PATH) or ".")
+    with open(TUNING_PATH, "w", encoding="utf-8") as wf:
+        json.dump({"cpus": os.cpu_count(), "pairs": pairs}, wf, indent=2)
+    log(f"Tuned settings written to {TUNING_PATH}", QUIET)
+
+# ---------- Main ----------
+def main():
+    global tm_db
+    safe_makedirs(TMP_OUTPUT)
+    safe_makedirs(FINAL_OUTPUT)
+
+    log("---- START ----")
+    log(f"Requested: {SRC} -> {', '.join(TARGETS)}")
+    if PIVOT_PREFERRED:
+        log(f"Preferred pivot order: {PIVOT_PREFERRED}")
+
+    load_index()
+    load_mirror_index()
+    # assembling shard outputs needs no model
+    if MODE != "merge":
+        plan()
+        install_models()
+        resolve_hops()
+        tm_db = open_translation_memory(TM_PATH)
+        if tm_db is not None:
+            log(f"Translation memory: {TM_PATH}")
+
+    if MODE == "serve":
+        serve()
+    elif MODE == "bench":
+        bench()
+    elif MODE == "autotune":
+        autotune()
+    elif MODE == "merge":
+        merge()
+    else:
+        run_files()
+        if WATCH:
+            load_models()
+            watch()
+
+    log_summary()
+    emit_metrics_summary()
+    save_route_cache()
+    if tm_db is not None:
+        tm_db.close()
+
+    log("---- DONE ----", QUIET)
 
-log("---- DONE ----")
+if __name__ == "__main__":
+    main()
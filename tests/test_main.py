@@ -0,0 +1,184 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("argostranslate")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import main  # noqa: E402
+
+ARB_SAMPLES = [
+    {},
+    {"@@locale": "fr"},
+    {"@@locale": "fr", "hello": "Bonjour", "@hello": {"description": "Greeting", "placeholders": {}}},
+    {"quote": 'Il a dit "oui"\n\tpuis\\non', "emoji": "😀 é ß", "ctrl": "\u0000\u001f "},
+    {"n": 1.5, "big": 12345678901234567890, "neg": -0.25, "exp": 1e-7, "t": True, "f": False, "z": None},
+    {"nested": {"a": [1, [2, {"b": []}], {}], "c": {"d": {"e": "f"}}}, "list": [], "obj": {}},
+    {"long": "x" * 100000, "after": "end"},
+]
+
+
+@pytest.mark.parametrize("data", ARB_SAMPLES)
+def test_arb_writer_matches_json_dump(tmp_path, data):
+    path = tmp_path / "out.arb"
+    writer = main.ArbWriter(str(path))
+    for key, value in data.items():
+        writer.write(key, value)
+    writer.close()
+    assert path.read_text(encoding="utf-8") == json.dumps(data, ensure_ascii=False, indent=2)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1 << 16])
+@pytest.mark.parametrize("data", ARB_SAMPLES)
+def test_iter_arb_round_trip(tmp_path, data, chunk_size):
+    path = tmp_path / "in.arb"
+    for indent in (None, 2):
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=indent), encoding="utf-8")
+        assert list(main.iter_arb(str(path), chunk_size=chunk_size)) == list(data.items())
+
+
+def test_iter_arb_rejects_truncated_file(tmp_path):
+    path = tmp_path / "in.arb"
+    path.write_text('{"a": "b", "c": 1.', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(main.iter_arb(str(path), chunk_size=4))
+
+
+ICU_SAMPLES = [
+    "plain text  ",
+    "Bonjour {name}, bienvenue",
+    "Don't {x}",
+    "{a}{b}",
+    "Total: {amount, number, ::currency/EUR} due",
+    "You and {count, plural, one {# other} other {# others}}",
+    "{count, plural, =0{No messages} one{# message from {name}} other{{count} messages}}",
+    "{gender, select, male {He} female {She} other {They}} liked it",
+    "You have {n, plural, offset:1 =1 {one item} other {# items}}.",
+    "{n, plural, other{{g, select, a {# in {place}} other {none #}}}}",
+    " {n, plural, other{}} ",
+    "Broken {",
+    "Broken } too",
+    "{n, plural, one {unterminated",
+]
+
+
+@pytest.mark.parametrize("text", ICU_SAMPLES)
+def test_icu_render_round_trip(text):
+    assert main.icu_render(main.icu_parse(text), {}) == text
+
+
+def upper(texts):
+    return [t.upper() for t in texts]
+
+
+def test_icu_messages_sent_whole(monkeypatch):
+    monkeypatch.setattr(main, "ICU_MESSAGES", True)
+    sent = []
+    out = main.translate_messages(
+        ["Bonjour {name}, bienvenue", "Hi {name}, {count, plural, one{# file} other{# files}}"],
+        lambda texts: sent.extend(texts) or upper(texts))
+    assert sent == ["Bonjour {0}, bienvenue", "Hi {0}, {1}", "{0} file", "{0} files"]
+    assert out == ["BONJOUR {name}, BIENVENUE", "HI {name}, {count, plural, one{# FILE} other{# FILES}}"]
+
+
+def test_icu_placeholders_can_move(monkeypatch):
+    monkeypatch.setattr(main, "ICU_MESSAGES", True)
+    out = main.translate_messages(["{a} de {b}"], lambda texts: ["{1} of {0}" for _ in texts])
+    assert out == ["{b} of {a}"]
+
+
+def test_icu_lost_placeholder_falls_back_to_fragments(monkeypatch):
+    monkeypatch.setattr(main, "ICU_MESSAGES", True)
+
+    def lossy(texts):
+        return [main.ICU_SENTINEL_RE.sub("", t).upper() for t in texts]
+    sent = []
+    out = main.translate_messages(["Bonjour {name}, bienvenue", "{g, select, a {Lui} other {Eux}}"],
+                                  lambda texts: sent.extend(texts) or lossy(texts))
+    assert out == ["BONJOUR {name}, BIENVENUE", "{g, select, a {LUI} other {EUX}}"]
+    assert sent[-2:] == ["Bonjour", ", bienvenue"]
+
+
+def test_icu_disabled_sends_values_whole(monkeypatch):
+    monkeypatch.setattr(main, "ICU_MESSAGES", False)
+    assert main.translate_messages(["a {b}"], upper) == ["A {B}"]
+
+
+@pytest.mark.parametrize("size, tokens", [(32, 0), (4, 0), (32, 20), (3, 10), (1, 1)])
+def test_schedule_batches(monkeypatch, size, tokens):
+    monkeypatch.setattr(main, "BATCH_SIZE", size)
+    monkeypatch.setattr(main, "BATCH_TOKENS", tokens)
+    lengths = [(i * 7919) % 13 + 1 for i in range(100)]
+    batches = main.schedule_batches(lengths)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    flat = [lengths[i] for batch in batches for i in batch]
+    assert flat == sorted(flat)
+    for batch in batches:
+        assert len(batch) <= size
+        if tokens and len(batch) > 1:
+            assert max(lengths[i] for i in batch) * len(batch) <= tokens
+
+
+def test_schedule_batches_empty():
+    assert main.schedule_batches([]) == []
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    for name, value in {"INPUT_DIR": tmp_path / "in", "TMP_OUTPUT": tmp_path / "tmp", "FINAL_OUTPUT": tmp_path / "out",
+                        "SHARD_DIR": tmp_path / "tmp" / ".shards"}.items():
+        value.mkdir(parents=True, exist_ok=True)
+        monkeypatch.setattr(main, name, str(value))
+    monkeypatch.setattr(main, "TARGETS", ["es"])
+    monkeypatch.setattr(main, "SHARD_COUNT", 2)
+    monkeypatch.setattr(main, "SHARD_KEYS", 1)
+    monkeypatch.setattr(main, "LOG_LEVEL", main.QUIET)
+
+    def run_shards(data, route=("fr", "es")):
+        (tmp_path / "in" / "app.arb").write_text(json.dumps(data), encoding="utf-8")
+        keys = main.string_keys(data)
+        for shard in range(main.SHARD_COUNT):
+            monkeypatch.setattr(main, "SHARD_INDEX", shard)
+            main.write_shard("app.arb", "es", list(route), data, keys, {k: f"[es]{data[k]}" for k in keys})
+    return tmp_path, run_shards
+
+
+def test_merge_assembles_shards(sharded):
+    tmp_path, run_shards = sharded
+    data = {"@@locale": "fr", "a": "Annuler", "b": "Supprimer", "c": "Ouvrir"}
+    run_shards(data)
+    main.merge()
+    out = json.loads((tmp_path / "out" / "app.arb").read_text(encoding="utf-8"))
+    assert out == {"@@locale": "es", "a": "[es]Annuler", "b": "[es]Supprimer", "c": "[es]Ouvrir"}
+
+
+def test_merge_rejects_stale_shards(sharded):
+    tmp_path, run_shards = sharded
+    run_shards({"@@locale": "fr", "a": "Annuler", "b": "Supprimer"})
+    (tmp_path / "in" / "app.arb").write_text(json.dumps({"@@locale": "fr", "a": "Supprimer", "b": "Supprimer"}),
+                                            encoding="utf-8")
+    with pytest.raises(SystemExit) as exit_info:
+        main.merge()
+    assert exit_info.value.code == 1
+    assert not (tmp_path / "out" / "app.arb").exists()
+
+
+def test_merge_rejects_other_shard_keys(sharded, monkeypatch):
+    tmp_path, run_shards = sharded
+    run_shards({"@@locale": "fr", "a": "Annuler", "b": "Supprimer"})
+    monkeypatch.setattr(main, "SHARD_KEYS", 2)
+    with pytest.raises(SystemExit):
+        main.merge()
+    assert not (tmp_path / "out" / "app.arb").exists()
+
+
+def test_merge_rejects_mixed_routes(sharded, monkeypatch):
+    tmp_path, run_shards = sharded
+    data = {"@@locale": "fr", "a": "Annuler", "b": "Supprimer", "c": "Ouvrir", "d": "Fermer"}
+    run_shards(data)
+    monkeypatch.setattr(main, "SHARD_INDEX", 1)
+    main.write_shard("app.arb", "es", ["fr", "en", "es"], data, main.string_keys(data), {})
+    with pytest.raises(SystemExit):
+        main.merge()
+    assert not (tmp_path / "out" / "app.arb").exists()